@@ -0,0 +1,123 @@
+"""
+Async versions of the row views, for serving through the ASGI application.
+Table lookups and reads use Django's async ORM, so a slow client reading
+a large table doesn't tie up a worker thread while it's being served.
+Inserts run in a thread, in one transaction with the update of the row count.
+These are plain Django views, since DRF's views are synchronous.
+"""
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.conf import settings
+from django.db import transaction
+from rest_framework.utils.urls import replace_query_param
+from api.models import DynamicModelTable, RowCountMode
+from api.rows import apaginate_rows, astream_rows, filter_rows
+from api.serializers import DynamicModelRowSerializer, DynamicModelRowsQuerySerializer
+from api.views import (
+    get_conditional_headers,
+    get_not_modified_response,
+    get_row_count_headers,
+    string_is_valid_uuid,
+)
+import json
+
+
+async def get_model_table(model_id):
+    """
+    Look the dynamic model table up by its model id, returning None if there is no such table.
+    """
+    if not string_is_valid_uuid(model_id):
+        return None
+    try:
+        return await DynamicModelTable.objects.aget(model_id=model_id)
+    except DynamicModelTable.DoesNotExist:
+        return None
+
+
+@transaction.atomic
+def create_row(model_table, django_model, fields):
+    """
+    Insert the row and count it in the table's cached row count, in one transaction.
+    """
+    django_model.objects.create(**fields)
+    model_table.mark_data_changed(row_delta=1)
+
+
+def not_found():
+    return JsonResponse({"detail": "Not found."}, status=404)
+
+
+@csrf_exempt
+@require_POST
+async def add_table_row(request, id):
+    """
+    Add row to dynamic model table.
+    """
+    model_table = await get_model_table(id)
+    if model_table is None:
+        return not_found()
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse({"detail": f"JSON parse error - {e}"}, status=400)
+
+    django_model = await model_table.aget_django_model()
+    serializer = DynamicModelRowSerializer(
+        data=data,
+        context={"model_table": model_table, "django_model": django_model},
+    )
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    try:
+        await sync_to_async(create_row)(model_table, django_model, serializer.validated_data["fields"])
+    except Exception as e:
+        return JsonResponse({"error": getattr(e, "messages", [str(e)])}, status=400)
+    return JsonResponse({"model_id": model_table.model_id}, status=201)
+
+
+@require_GET
+async def get_table_rows(request, id):
+    """
+    Get a dynamic model table's row data.
+    """
+    model_table = await get_model_table(id)
+    if model_table is None:
+        return not_found()
+    not_modified = get_not_modified_response(request, model_table)
+    if not_modified is not None:
+        return not_modified
+    django_model = await model_table.aget_django_model()
+    query_serializer = DynamicModelRowsQuerySerializer(data=request.GET, context={"django_model": django_model})
+    if not query_serializer.is_valid():
+        return JsonResponse(query_serializer.errors, status=400)
+    params = query_serializer.validated_data
+    column_names = params.get("fields") or [
+        f.name for f in django_model._meta.concrete_fields if not f.primary_key
+    ]
+    queryset = filter_rows(django_model.objects.all(), params["filters"])
+    if settings.DYNAMIC_MODEL_ROW_COUNT_MODE == RowCountMode.CACHED and model_table.row_count is not None:
+        # already loaded with the table
+        headers = get_row_count_headers(model_table, queryset, params["filters"])
+    else:
+        headers = await sync_to_async(get_row_count_headers)(model_table, queryset, params["filters"])
+    headers.update(get_conditional_headers(model_table))
+
+    if params["stream"]:
+        return StreamingHttpResponse(
+            astream_rows(queryset, column_names, cursor=params.get("cursor"), ordering=params["ordering"]),
+            content_type="application/x-ndjson",
+            headers=headers,
+        )
+
+    limit = params.get("limit", settings.DYNAMIC_MODEL_ROWS_PAGE_SIZE)
+    rows, next_cursor = await apaginate_rows(
+        queryset, column_names, limit, cursor=params.get("cursor"), ordering=params["ordering"]
+    )
+    response = JsonResponse(rows, safe=False, encoder=DjangoJSONEncoder, headers=headers)
+    if next_cursor is not None:
+        next_url = replace_query_param(request.build_absolute_uri(), "cursor", next_cursor)
+        response["Link"] = f'<{next_url}>; rel="next"'
+    return response
@@ -0,0 +1,57 @@
+"""
+Postgres backend which records how long requests wait for a DB connection.
+With persistent connections that's the time it takes to connect, which is only
+paid once a connection outlived CONN_MAX_AGE or failed its health check.
+With a connection pool it's the time spent waiting for a free pooled connection.
+"""
+from django.conf import settings
+from django.db.backends.postgresql import base
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    """
+    Counts the connections a process opened or took from the pool, and the time spent waiting for them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.wait_time = 0.0
+            self.max_wait_time = 0.0
+
+    def record(self, wait_time):
+        with self._lock:
+            self.connections += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "wait_ms_total": round(self.wait_time * 1000, 3),
+                "wait_ms_max": round(self.max_wait_time * 1000, 3),
+            }
+
+
+connection_stats = ConnectionStats()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        started = time.monotonic()
+        connection = super().get_new_connection(conn_params)
+        wait_time = time.monotonic() - started
+        connection_stats.record(wait_time)
+        if wait_time * 1000 >= settings.DB_CONNECTION_WAIT_WARNING:
+            logger.warning("Waited %.1f ms for a DB connection", wait_time * 1000)
+        return connection
@@ -0,0 +1,213 @@
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+from api.models import DynamicModelTable, Job, JobKind, JobRowBatch, JobStatus
+from api.rows import DEFAULT_BULK_BATCH_SIZE, DEFAULT_BULK_MAX_ERRORS, batched, ingest_rows
+from api.serializers import DynamicModelSerializer
+from datetime import timedelta
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_table(job):
+    payload = job.payload
+    data = {"fields": payload["fields"], "indexes": payload.get("indexes", [])}
+    if payload.get("natural_key"):
+        data["natural_key"] = payload["natural_key"]
+    serializer = DynamicModelSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+def update_table(job):
+    payload = job.payload
+    serializer = DynamicModelSerializer(
+        data={"fields": payload["fields"], "indexes": payload.get("indexes", [])},
+        context={"model_id": payload["model_id"]},
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.update_model(payload["model_id"], online=payload.get("online", False))
+
+
+def bulk_add_rows(job):
+    """
+    Load the job's staged row batches, see enqueue_bulk_add_rows. Every batch is
+    deleted in the transaction which loads it, along with recording the result so far,
+    so a job which is run again carries on with the batches it didn't load yet.
+    """
+    payload = job.payload
+    try:
+        model_table = DynamicModelTable.objects.get(model_id=payload["model_id"])
+    except DynamicModelTable.DoesNotExist:
+        return {"error": f"Could not find model with ID of {payload['model_id']}."}
+    natural_key = model_table.natural_key if payload.get("upsert") else None
+    if "rows" in payload:
+        # queued with the rows in the payload, before uploads were staged
+        return ingest_rows(
+            model_table.get_django_model(),
+            payload["rows"],
+            batch_size=payload.get("batch_size"),
+            model_table=model_table,
+            natural_key=natural_key,
+        )
+
+    max_errors = getattr(settings, "DYNAMIC_MODEL_BULK_MAX_ERRORS", DEFAULT_BULK_MAX_ERRORS)
+    written = "upserted" if natural_key else "inserted"
+    result = job.result or {written: 0, "error_count": 0, "errors": []}
+    django_model = model_table.get_django_model()
+    # loaded batches are deleted, so the first one left is the next one to load
+    while (row_batch := job.row_batches.order_by("pk").first()) is not None:
+        with transaction.atomic():
+            batch_result = ingest_rows(
+                django_model,
+                row_batch.rows,
+                batch_size=len(row_batch.rows),
+                model_table=model_table,
+                natural_key=natural_key,
+                first_row_number=row_batch.first_row,
+            )
+            result[written] += batch_result[written]
+            result["error_count"] += batch_result["error_count"]
+            result["errors"].extend(batch_result["errors"][:max_errors - len(result["errors"])])
+            row_batch.delete()
+            job.result = result
+            job.save(update_fields=["result"])
+    return result
+
+
+# functions running each kind of job, called with the job.
+# A returned dict with an 'error' key marks the job as failed.
+JOB_HANDLERS = {
+    JobKind.CREATE_TABLE: create_table,
+    JobKind.UPDATE_TABLE: update_table,
+    JobKind.BULK_ADD_ROWS: bulk_add_rows,
+}
+
+
+def enqueue_job(kind, payload):
+    """
+    Queue a table operation for the run_jobs workers.
+    """
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def enqueue_bulk_add_rows(payload, rows):
+    """
+    Queue a bulk load, staging the uploaded rows in batches of the payload's batch_size
+    outside of the payload, so they're never held in memory as a whole.
+    Returns None, queueing nothing, if there are more than DYNAMIC_MODEL_JOB_MAX_ROWS rows.
+    """
+    batch_size = payload.get("batch_size") or getattr(
+        settings, "DYNAMIC_MODEL_BULK_BATCH_SIZE", DEFAULT_BULK_BATCH_SIZE
+    )
+    staged = 0
+    with transaction.atomic():
+        job = enqueue_job(JobKind.BULK_ADD_ROWS, payload)
+        for batch in batched(rows, batch_size):
+            if staged + len(batch) > settings.DYNAMIC_MODEL_JOB_MAX_ROWS:
+                transaction.set_rollback(True)
+                return None
+            JobRowBatch.objects.create(job=job, first_row=staged + 1, rows=batch)
+            staged += len(batch)
+    return job
+
+
+def claim_job(worker):
+    """
+    Mark the oldest pending job as running and return it, or None if there is none.
+    Jobs locked by other workers are skipped rather than waited for,
+    so any number of workers can poll the queue at the same time.
+    Once no job is pending, running jobs whose worker sent no heartbeat for
+    DYNAMIC_MODEL_JOB_LEASE seconds, e.g. because it died, are claimed again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = Job.objects.select_for_update(skip_locked=True)
+        job = jobs.filter(status=JobStatus.PENDING).order_by("created_at").first()
+        if job is None:
+            lease_expired_at = now - timedelta(seconds=settings.DYNAMIC_MODEL_JOB_LEASE)
+            job = (
+                jobs.filter(status=JobStatus.RUNNING, heartbeat_at__lt=lease_expired_at)
+                .order_by("heartbeat_at")
+                .first()
+            )
+            if job is None:
+                return None
+            logger.warning("Worker %s of job %s stopped sending heartbeats, running the job again", job.worker, job.pk)
+        job.status = JobStatus.RUNNING
+        job.worker = worker
+        job.started_at = now
+        job.heartbeat_at = now
+        job.save(update_fields=["status", "worker", "started_at", "heartbeat_at"])
+    return job
+
+
+class JobHeartbeat(threading.Thread):
+    """
+    Shows that the worker running a job is alive, by recording a heartbeat on the job
+    every third of DYNAMIC_MODEL_JOB_LEASE seconds until stopped. Runs on a thread
+    with a DB connection of its own, so it's sent while the job runs its queries.
+    """
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job = job
+        self.interval = settings.DYNAMIC_MODEL_JOB_LEASE / 3
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    # a job claimed again by another worker isn't this one's anymore
+                    Job.objects.filter(pk=self.job.pk, status=JobStatus.RUNNING, worker=self.job.worker).update(
+                        heartbeat_at=timezone.now()
+                    )
+                except DatabaseError:
+                    logger.exception("Heartbeat of job %s failed", self.job.pk)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its outcome.
+    """
+    heartbeat = JobHeartbeat(job)
+    heartbeat.start()
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s failed", job.pk)
+        result = {"error": str(e)}
+    finally:
+        heartbeat.stop()
+    job.result = result
+    job.status = JobStatus.FAILED if result.get("error") else JobStatus.SUCCEEDED
+    job.finished_at = timezone.now()
+    # uploaded rows aren't kept once the job is done
+    job.payload.pop("rows", None)
+    job.row_batches.all().delete()
+    job.save(update_fields=["payload", "result", "status", "finished_at"])
+    return job
+
+
+def process_jobs(worker, max_jobs=None):
+    """
+    Run pending jobs one after another until the queue is empty,
+    or max_jobs were run. Returns the number of jobs run.
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_job(worker)
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.models import App, DynamicModelTable
+from uuid import uuid4
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark DynamicModelTable lookups by model_id against the number of registered tables, "
+        "with and without the model_id index. Runs in a transaction which is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+            help="Numbers of registered tables to measure at.",
+        )
+        parser.add_argument("--lookups", type=int, default=500, help="Number of timed lookups per measurement.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options["sizes"], options["lookups"])
+            transaction.set_rollback(True)
+
+    def run(self, sizes, lookups):
+        app = App.objects.first()
+        model_ids = []
+        for size in sorted(sizes):
+            new_ids = [uuid4() for _ in range(size - len(model_ids))]
+            DynamicModelTable.objects.bulk_create(
+                [DynamicModelTable(app=app, model_id=model_id) for model_id in new_ids],
+                batch_size=5000,
+            )
+            model_ids += new_ids
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE api_dynamicmodeltable")
+
+            indexed = self.time_lookups(model_ids, lookups)
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('DROP INDEX "api_dynamicmodeltable_model_id_uniq"')
+                unindexed = self.time_lookups(model_ids, lookups)
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{size:>9,} tables: {indexed * 1000:8.3f} ms/lookup indexed, "
+                f"{unindexed * 1000:8.3f} ms/lookup without index"
+            )
+
+    def time_lookups(self, model_ids, lookups):
+        sample = random.sample(model_ids, min(lookups, len(model_ids)))
+        start = time.perf_counter()
+        for model_id in sample:
+            DynamicModelTable.objects.get(model_id=model_id)
+        return (time.perf_counter() - start) / len(sample)
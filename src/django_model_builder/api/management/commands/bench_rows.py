@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from api.models import DynamicModelTable
+from api.registry import model_registry
+from api.rows import ingest_rows
+from api.serializers import DynamicModelSerializer, create_serializer_for_model
+import time
+
+
+class Command(BaseCommand):
+    help = "Benchmark reading rows of a dynamic table, with and without input validation of the read rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000, help="Number of rows in the benchmark table.")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of timed reads per read path.")
+
+    def handle(self, *args, **options):
+        serializer = DynamicModelSerializer(data={"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}})
+        serializer.is_valid(raise_exception=True)
+        model_id = serializer.save()["model_id"]
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        django_model = model_table.get_django_model()
+        try:
+            rows = ({"name": f"row {i}", "age": i, "insured": i % 2 == 0} for i in range(options["rows"]))
+            ingest_rows(django_model, rows)
+            column_names = [f.name for f in django_model._meta.concrete_fields if not f.primary_key]
+
+            def validated_read():
+                # the read path as it was: rows re-validated through a generated ModelSerializer
+                data = list(django_model.objects.values(*[f.name for f in django_model._meta.get_fields()]))
+                model_serializer = create_serializer_for_model(django_model)(data=data, many=True)
+                model_serializer.is_valid(raise_exception=True)
+                return JSONRenderer().render(model_serializer.data)
+
+            def direct_read():
+                return JSONRenderer().render(list(django_model.objects.order_by("pk").values(*column_names)))
+
+            for name, read in (("validated", validated_read), ("direct", direct_read)):
+                timings = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    read()
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                self.stdout.write(
+                    f"{name:>10}: {options['rows'] / best:>12,.0f} rows/s (best of {options['repeat']}, {best:.3f}s)"
+                )
+        finally:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.delete_model(django_model)
+            model_table.delete()
+            model_registry.evict(model_id)
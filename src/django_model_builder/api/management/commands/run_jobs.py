@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from api.jobs import process_jobs
+import os
+import socket
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued table operations. Any number of workers can run side by side, "
+        "each job is only picked up by one of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument(
+            "--poll-interval", type=float, default=settings.DYNAMIC_MODEL_JOB_POLL_INTERVAL,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--worker", default=f"{socket.gethostname()}:{os.getpid()}",
+            help="Name recorded on the jobs this worker runs.",
+        )
+
+    def handle(self, *args, **options):
+        worker = options["worker"]
+        self.stdout.write(f"Worker {worker} waiting for jobs")
+        try:
+            while True:
+                # drop connections which went away or outlived CONN_MAX_AGE while idle
+                close_old_connections()
+                processed = process_jobs(worker)
+                if processed:
+                    self.stdout.write(f"Ran {processed} job(s)")
+                if options["once"]:
+                    break
+                if not processed:
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
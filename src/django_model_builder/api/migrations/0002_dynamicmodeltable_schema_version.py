@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='schema_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
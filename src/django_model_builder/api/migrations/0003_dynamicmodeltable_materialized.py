@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_dynamicmodeltable_schema_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='materialized',
+            field=models.BooleanField(default=False),
+        ),
+    ]
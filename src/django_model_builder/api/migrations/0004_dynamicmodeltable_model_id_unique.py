@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0003_dynamicmodeltable_materialized'),
+    ]
+
+    operations = [
+        # Build the unique index without locking the table against writes,
+        # then record the matching unique=True in the migration state.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "api_dynamicmodeltable_model_id_uniq" '
+                        'ON "api_dynamicmodeltable" ("model_id")',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "api_dynamicmodeltable_model_id_uniq"',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='dynamicmodeltable',
+                    name='model_id',
+                    field=models.UUIDField(unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('fields', models.JSONField()),
+                ('unique', models.BooleanField(default=False)),
+                ('condition', models.JSONField(blank=True, default=dict)),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexes', to='api.dynamicmodeltable')),
+            ],
+            options={
+                'unique_together': {('model', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_tableindex'),
+    ]
+
+    operations = [
+        # existing tables start with an unknown count, which is counted on first use
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='row_count',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='dynamicmodeltable',
+            name='row_count',
+            field=models.BigIntegerField(default=0, null=True),
+        ),
+    ]
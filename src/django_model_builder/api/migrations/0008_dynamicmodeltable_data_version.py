@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_dynamicmodeltable_row_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='data_modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
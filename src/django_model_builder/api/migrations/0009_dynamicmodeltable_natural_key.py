@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dynamicmodeltable_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicmodeltable',
+            name='natural_key',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_dynamicmodeltable_natural_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRowBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_row', models.PositiveIntegerField()),
+                ('rows', models.JSONField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='row_batches', to='api.job')),
+            ],
+        ),
+    ]
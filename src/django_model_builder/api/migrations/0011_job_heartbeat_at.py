@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_jobrowbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # jobs running already are presumed alive from when they started
+        migrations.RunSQL(
+            "UPDATE api_job SET heartbeat_at = started_at WHERE status = 'RUNNING'",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'RUNNING')), fields=['heartbeat_at'], name='api_job_running_idx'),
+        ),
+    ]
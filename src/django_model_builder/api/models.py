@@ -1,6 +1,12 @@
+from asgiref.sync import sync_to_async
 from django.core.validators import ValidationError
 from django.db import models, connection
-from django.db.utils import ProgrammingError
+from django.db.models.functions import Now
+from django.utils import timezone
+from api.registry import model_registry
+import hashlib
+import json
+import uuid
 
 
 class FieldType(models.TextChoices):
@@ -9,17 +15,24 @@ class FieldType(models.TextChoices):
     BOOLEAN = "BOOL", "Boolean"
 
 
+class RowCountMode(models.TextChoices):
+    EXACT = "exact", "Exact"
+    ESTIMATE = "estimate", "Estimate"
+    CACHED = "cached", "Cached"
+
+
 class DynamicModelFactory:
     def create_model(self, name, fields=None, options=None):
         """
         Dynamically create specified model with provided model fields and Meta options.
+        Only builds the class, the table is created by save_model_in_db.
         """
         class Meta:
             app_label = "api"
 
         # Update Meta with any options that were provided
         if options is not None:
-            for key, value in options.iteritems():
+            for key, value in options.items():
                 setattr(Meta, key, value)
 
         # Set up a dictionary to simulate declarations within a class
@@ -30,22 +43,19 @@ class DynamicModelFactory:
             attrs.update(fields)
 
         # Create the class, which automatically triggers ModelBase processing
-        model = type(name, (models.Model,), attrs)
-        self.save_model_in_db(model)
-        return model
+        return type(name, (models.Model,), attrs)
     
     def save_model_in_db(self, model):
         """
-        Given a Django model, try to save it in the database.
-        Skips creation if model already present in DB.
+        Given a Django model, create its table in the database.
+        Skips creation if the table is already present in the DB.
+        Returns whether the table was created.
         """
-        try:
-            with connection.schema_editor() as schema_editor:
-                schema_editor.create_model(model)
-        # catch case where db already created the model table earlier
-        # which results in a django.db.utils.ProgrammingError
-        except ProgrammingError:
-            pass
+        if model._meta.db_table in connection.introspection.table_names():
+            return False
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(model)
+        return True
 
 
 class App(models.Model):
@@ -66,7 +76,19 @@ class DynamicModelTable(models.Model):
     """
     app = models.ForeignKey(App, related_name='models', on_delete=models.CASCADE)
     # model_id functions as the model name
-    model_id = models.UUIDField(blank=False)
+    model_id = models.UUIDField(blank=False, unique=True)
+    # bumped on every field change, so that workers can tell their cached classes are stale
+    schema_version = models.PositiveIntegerField(default=0)
+    # whether the model's table exists in the DB
+    materialized = models.BooleanField(default=False)
+    # number of rows, kept up to date by the row insertion paths. NULL when unknown
+    row_count = models.BigIntegerField(null=True, default=0)
+    # bumped on every change of the rows, so that clients can tell their copy is stale
+    data_version = models.PositiveBigIntegerField(default=0)
+    # when the rows or the schema last changed
+    data_modified_at = models.DateTimeField(default=timezone.now)
+    # field names identifying a row for upserts, backed by a unique index. Empty if the table has none
+    natural_key = models.JSONField(default=list, blank=True)
 
     class Meta:
         unique_together = (('app', 'model_id'),)
@@ -76,13 +98,124 @@ class DynamicModelTable(models.Model):
 
     def get_django_model(self):
         """
-        Returns a functional Django model based on current data
+        Returns a functional Django model based on current data.
+        Built classes are cached per schema version, so repeated calls
+        don't rebuild the class or query the model's fields.
+        """
+        version = self.schema_version
+        django_model = model_registry.get(self.model_id, version)
+        if django_model is not None:
+            return django_model
+
+        django_model = self.build_django_model(self.fields.all(), self.indexes.all())
+        # only models whose table isn't known to exist pay for DDL
+        if not self.materialized:
+            DynamicModelFactory().save_model_in_db(django_model)
+            self.mark_materialized()
+        model_registry.set(self.model_id, version, django_model)
+        return django_model
+
+    def build_django_model(self, fields, table_indexes):
+        """
+        Build the model class from the model's Field and TableIndex objects,
+        without caching it or touching the DB.
         """
         # Get all associated fields into a list ready for dict()
-        fields = [(f.name, f.get_django_field()) for f in self.fields.all()]
+        fields = [(f.name, f.get_django_field()) for f in fields]
+        # declared indexes, with unique ones expressed as constraints
+        indexes = [index.get_django_index() for index in table_indexes]
+        options = {
+            "indexes": [index for index in indexes if isinstance(index, models.Index)],
+            "constraints": [index for index in indexes if isinstance(index, models.UniqueConstraint)],
+        }
 
         # Use the create_model function defined above
-        return DynamicModelFactory().create_model(str(self.model_id), dict(fields))
+        factory = DynamicModelFactory()
+        return factory.create_model(str(self.model_id), dict(fields), options)
+
+    async def aget_django_model(self):
+        """
+        Async version of get_django_model.
+        Cached classes are returned without leaving the event loop.
+        """
+        django_model = model_registry.get(self.model_id, self.schema_version)
+        if django_model is not None:
+            return django_model
+        return await sync_to_async(self.get_django_model)()
+
+    def get_row_count(self, mode, queryset=None):
+        """
+        Count the model's rows, or those of a queryset over them.
+        'exact' runs COUNT(*), without locking or writing the table's row.
+        'estimate' reads the planner's estimate, falling back to an exact count
+        for tables which weren't analyzed yet. 'cached' returns the kept count,
+        counting the rows once if it's unknown. Only exact counts apply to querysets.
+        """
+        if queryset is not None:
+            return queryset.count()
+        if mode == RowCountMode.CACHED and self.row_count is not None:
+            return self.row_count
+        django_model = self.get_django_model()
+        if mode == RowCountMode.ESTIMATE:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [connection.ops.quote_name(django_model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+            if row is not None and row[0] >= 0:
+                return row[0]
+        count = django_model.objects.count()
+        if mode == RowCountMode.CACHED:
+            # rows only change along with the data version, so the count is
+            # only kept if no change was committed since this object was loaded
+            stored = DynamicModelTable.objects.filter(
+                pk=self.pk, data_version=self.data_version, row_count__isnull=True
+            ).update(row_count=count)
+            if stored:
+                self.row_count = count
+        return count
+
+    def mark_data_changed(self, row_delta=0):
+        """
+        Bump the data version, and add row_delta to the cached row count.
+        A row_delta of None marks the row count as unknown, so it's counted again when needed.
+        Meant to run last in the transaction changing the rows, so the table row is only locked briefly.
+        """
+        DynamicModelTable.objects.filter(pk=self.pk).update(**self.get_data_change(row_delta))
+
+    def get_data_change(self, row_delta):
+        return {
+            "row_count": None if row_delta is None else models.F("row_count") + row_delta,
+            "data_version": models.F("data_version") + 1,
+            "data_modified_at": Now(),
+        }
+
+    def get_etag(self):
+        """
+        ETag of the table's rows, which changes with every change of the rows or the schema.
+        """
+        return f'"{self.schema_version}.{self.data_version}"'
+
+    def mark_materialized(self):
+        """
+        Record that the model's table exists in the DB.
+        """
+        DynamicModelTable.objects.filter(pk=self.pk).update(materialized=True)
+        self.materialized = True
+
+    def bump_schema_version(self):
+        """
+        Increment the schema version in the DB.
+        Meant to run in the same transaction as the field changes, so other
+        workers only see the new version together with the new fields.
+        """
+        DynamicModelTable.objects.filter(pk=self.pk).update(
+            schema_version=models.F("schema_version") + 1,
+            data_modified_at=Now(),
+        )
+        self.refresh_from_db(fields=["schema_version", "data_modified_at"])
+        model_registry.evict(self.model_id)
 
 
 def is_valid_field(self, field_data, all_data):
@@ -122,3 +255,95 @@ class Field(models.Model):
                     f"Could not resolve field_type {self.field_type} into a Django model field."
                 )
         return django_field
+
+
+class TableIndex(models.Model):
+    """
+    Secondary index declared on a dynamic model's columns.
+    """
+    model = models.ForeignKey(DynamicModelTable, related_name='indexes', on_delete=models.CASCADE)
+    name = models.CharField(max_length=30)
+    # indexed column names, in index order
+    fields = models.JSONField()
+    unique = models.BooleanField(default=False)
+    # BOOL column names mapped to the value rows need to be indexed, for partial indexes
+    condition = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        unique_together = (('model', 'name'),)
+
+    @staticmethod
+    def make_name(model_id, fields, unique=False, condition=None):
+        """
+        Derive the DB index name from the index's definition.
+        Index names are unique per schema, so the model id is part of the hash.
+        """
+        definition = json.dumps([str(model_id), list(fields), unique, sorted((condition or {}).items())])
+        return "dm_ix_{}".format(hashlib.md5(definition.encode()).hexdigest()[:24])
+
+    def get_django_index(self):
+        """
+        Map the declaration to a Django Index, or a UniqueConstraint for unique indexes.
+        """
+        condition = models.Q(**self.condition) if self.condition else None
+        if self.unique:
+            return models.UniqueConstraint(fields=self.fields, name=self.name, condition=condition)
+        return models.Index(fields=self.fields, name=self.name, condition=condition)
+
+
+class JobStatus(models.TextChoices):
+    PENDING = "PENDING", "Pending"
+    RUNNING = "RUNNING", "Running"
+    SUCCEEDED = "SUCCEEDED", "Succeeded"
+    FAILED = "FAILED", "Failed"
+
+
+class JobKind(models.TextChoices):
+    CREATE_TABLE = "CREATE_TABLE", "Create table"
+    UPDATE_TABLE = "UPDATE_TABLE", "Update table"
+    BULK_ADD_ROWS = "BULK_ADD_ROWS", "Bulk add rows"
+
+
+class Job(models.Model):
+    """
+    A table operation queued to run outside of the request, picked up by the run_jobs command.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=32, choices=JobKind)
+    status = models.CharField(max_length=16, choices=JobStatus, default=JobStatus.PENDING)
+    # arguments of the operation, and what it returned once finished
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    # identifies the worker which claimed the job
+    worker = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # last time the worker running the job showed it's alive, see claim_job
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # workers look for the oldest pending job
+            models.Index(
+                fields=["created_at"],
+                name="api_job_pending_idx",
+                condition=models.Q(status="PENDING"),
+            ),
+            # and for running jobs whose worker died
+            models.Index(
+                fields=["heartbeat_at"],
+                name="api_job_running_idx",
+                condition=models.Q(status="RUNNING"),
+            ),
+        ]
+
+
+class JobRowBatch(models.Model):
+    """
+    A batch of the rows uploaded for a bulk load job, staged until the job loads it.
+    """
+    job = models.ForeignKey(Job, related_name='row_batches', on_delete=models.CASCADE)
+    # number of the batch's first row in the upload, for reporting row errors
+    first_row = models.PositiveIntegerField()
+    rows = models.JSONField()
@@ -0,0 +1,49 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+import codecs
+import csv
+import json
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON into a lazy iterator of rows,
+    so large uploads are never held in memory as a whole.
+    """
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        return self.iter_rows(codecs.getreader(encoding)(stream))
+
+    def iter_rows(self, lines):
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ParseError(f"NDJSON parse error on line {line_number} - {e}")
+
+
+class CSVParser(BaseParser):
+    """
+    Parses CSV with a header row into a lazy iterator of rows.
+    Empty cells are read as nulls, as Postgres' COPY does.
+    """
+    media_type = "text/csv"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        return self.iter_rows(codecs.getreader(encoding)(stream))
+
+    def iter_rows(self, lines):
+        try:
+            for row in csv.DictReader(lines):
+                yield {key: (value if value != "" else None) for key, value in row.items()}
+        except csv.Error as e:
+            raise ParseError(f"CSV parse error - {e}")
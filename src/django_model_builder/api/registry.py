@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from django.apps import apps
+from django.conf import settings
+import threading
+
+
+DEFAULT_CACHE_SIZE = 1024
+
+
+class DynamicModelRegistry:
+    """
+    Process-wide LRU cache of built dynamic Django model classes.
+    Entries are keyed by model_id and the schema version they were built from.
+    The version is read from the DynamicModelTable row each request loads anyway,
+    so a schema change made by any worker makes the cached class unreachable.
+    """
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, "DYNAMIC_MODEL_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+
+    def get(self, model_id, version):
+        """
+        Return the cached model class, or None if missing or built from an older schema.
+        """
+        key = str(model_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_version, model = entry
+            if cached_version != version:
+                self.evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return model
+
+    def set(self, model_id, version, model):
+        """
+        Cache a model class, evicting the least recently used entries past maxsize.
+        """
+        key = str(model_id)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous[1] is not model:
+                self._unregister(previous[1])
+            self._entries[key] = (version, model)
+            while len(self._entries) > max(self.maxsize, 1):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._unregister(evicted)
+
+    def evict(self, model_id):
+        with self._lock:
+            entry = self._entries.pop(str(model_id), None)
+            if entry is not None:
+                self._unregister(entry[1])
+
+    def clear(self):
+        with self._lock:
+            for _, model in self._entries.values():
+                self._unregister(model)
+            self._entries.clear()
+
+    def __contains__(self, model_id):
+        return str(model_id) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unregister(self, model):
+        """
+        Remove a model class from Django's app registry, so evicted classes
+        can be garbage collected and rebuilt without a re-registration warning.
+        """
+        app_models = apps.all_models[model._meta.app_label]
+        if app_models.get(model._meta.model_name) is model:
+            del app_models[model._meta.model_name]
+            apps.get_models.cache_clear()
+
+
+model_registry = DynamicModelRegistry()
@@ -0,0 +1,566 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from rest_framework.exceptions import ParseError
+from api.models import FieldType
+from itertools import islice
+import base64
+import io
+import json
+
+
+DEFAULT_BULK_BATCH_SIZE = 1000
+DEFAULT_BULK_MAX_ERRORS = 100
+DEFAULT_STREAM_CHUNK_SIZE = 2000
+
+
+def get_row_validators(django_model):
+    """
+    Map each of a dynamic model's columns to a function which converts a raw
+    input value into its Python value, raising a ValidationError if it doesn't fit.
+    Built from the model class, so it needs no Field queries, and kept on
+    the class, which is rebuilt on every schema change.
+    """
+    validators = django_model.__dict__.get("_row_validators")
+    if validators is None:
+        validators = {}
+        for field in django_model._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            validators[field.name] = make_field_validator(field)
+        django_model._row_validators = validators
+    return validators
+
+
+# FieldType of each Django field class built by Field.get_django_field
+FIELD_TYPES = {
+    "CharField": FieldType.STRING,
+    "IntegerField": FieldType.NUMBER,
+    "BooleanField": FieldType.BOOLEAN,
+}
+
+# row filter lookups allowed on each field type, and the ORM lookup they compile to
+FILTER_LOOKUPS = {
+    "eq": "exact",
+    "lt": "lt",
+    "gt": "gt",
+    "in": "in",
+    "contains": "contains",
+    "isnull": "isnull",
+}
+FIELD_TYPE_LOOKUPS = {
+    FieldType.STRING: {"eq", "lt", "gt", "in", "contains", "isnull"},
+    FieldType.NUMBER: {"eq", "lt", "gt", "in", "isnull"},
+    FieldType.BOOLEAN: {"eq", "in", "isnull"},
+}
+
+# aggregate functions available to the aggregate view
+AGGREGATE_FUNCTIONS = {
+    "count": Count,
+    "sum": Sum,
+    "avg": Avg,
+    "min": Min,
+    "max": Max,
+}
+
+
+def get_column_types(django_model):
+    """
+    Map each of a dynamic model's columns, and 'id', to its FieldType.
+    Kept on the class, like the row validators.
+    """
+    column_types = django_model.__dict__.get("_column_types")
+    if column_types is None:
+        column_types = {"id": FieldType.NUMBER}
+        for field in django_model._meta.concrete_fields:
+            if not field.primary_key:
+                column_types[field.name] = FIELD_TYPES[field.get_internal_type()]
+        django_model._column_types = column_types
+    return column_types
+
+
+# error of the raw values each field type turns away before converting them
+VALUE_TYPE_ERRORS = {
+    FieldType.STRING: "Expected a string.",
+    FieldType.NUMBER: "Expected an integer.",
+    FieldType.BOOLEAN: "Expected a boolean.",
+}
+
+
+def has_value_type(field_type, value):
+    """
+    Whether a raw input value is of a type the field type takes, so that it's
+    converted rather than coerced. Numbers and booleans may be strings, as in CSV.
+    """
+    match field_type:
+        case FieldType.STRING:
+            return isinstance(value, str)
+        case FieldType.NUMBER:
+            if isinstance(value, float):
+                # only whole numbers, rather than truncating them
+                return value.is_integer()
+            return isinstance(value, (int, str)) and not isinstance(value, bool)
+        case FieldType.BOOLEAN:
+            return isinstance(value, (bool, int, str))
+    return False
+
+
+def make_field_validator(field):
+    field_type = FIELD_TYPES[field.get_internal_type()]
+
+    def validate(value):
+        if value is not None and not has_value_type(field_type, value):
+            raise ValidationError(VALUE_TYPE_ERRORS[field_type], code="invalid")
+        value = field.to_python(value)
+        if value is not None:
+            field.run_validators(value)
+        return value
+    return validate
+
+
+def clean_row(row, validators):
+    """
+    Validate a single row against the model's columns.
+    Returns a tuple of the cleaned values and a dict of errors per column.
+    """
+    if not isinstance(row, dict):
+        return None, {"non_field_errors": ["Expected an object of column values."]}
+
+    values, errors = {}, {}
+    for name, value in row.items():
+        validator = validators.get(name)
+        if validator is None:
+            errors[name] = ["Field '{}' not found in model.".format(name)]
+            continue
+        try:
+            values[name] = validator(value)
+        except ValidationError as e:
+            errors[name] = e.messages
+    return values, errors
+
+
+def batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def copy_available():
+    """
+    Whether rows can be loaded with Postgres' COPY FROM STDIN.
+    """
+    return (
+        connection.vendor == "postgresql"
+        and getattr(settings, "DYNAMIC_MODEL_BULK_USE_COPY", True)
+    )
+
+
+def to_copy_value(value):
+    """
+    Render a value as a COPY CSV field. Nulls are left unquoted and strings
+    are always quoted, so that empty strings and nulls stay distinct.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, str):
+        return '"{}"'.format(value.replace('"', '""'))
+    return str(value)
+
+
+def copy_rows(django_model, rows):
+    """
+    Insert rows with a single COPY FROM STDIN statement.
+    """
+    fields = [f for f in django_model._meta.concrete_fields if not f.primary_key]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(to_copy_value(row.get(field.attname)) for field in fields))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        quote_name(django_model._meta.db_table),
+        ", ".join(quote_name(field.column) for field in fields),
+    )
+    with connection.cursor() as cursor:
+        if hasattr(cursor.cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def insert_rows(django_model, rows, use_copy=False):
+    """
+    Insert a batch of already validated rows in one statement.
+    """
+    if use_copy:
+        copy_rows(django_model, rows)
+    else:
+        django_model.objects.bulk_create([django_model(**row) for row in rows])
+
+
+def get_natural_key_errors(values, natural_key):
+    """
+    Upserted rows need a value for every natural key field, since NULLs never conflict.
+    Returns a dict of errors per missing field.
+    """
+    return {
+        name: ["This field is required for upserts."]
+        for name in natural_key if values.get(name) is None
+    }
+
+
+def upsert_rows(django_model, rows, natural_key):
+    """
+    Insert a batch of already validated rows, replacing the rows with the same
+    natural key, in one INSERT ... ON CONFLICT DO UPDATE statement.
+    Fields missing from a row are set to NULL.
+    Returns how many of the rows were new, rather than replacing a row.
+    """
+    # a statement can't update the same row twice, so the last row of a key wins
+    rows = list({tuple(row[name] for name in natural_key): row for row in rows}.values())
+    fields = [field for field in django_model._meta.concrete_fields if not field.primary_key]
+    quote_name = connection.ops.quote_name
+    key_columns = [quote_name(django_model._meta.get_field(name).column) for name in natural_key]
+    update_columns = [quote_name(field.column) for field in fields if field.name not in natural_key]
+    if update_columns:
+        # xmax is only set on rows which an update replaced
+        conflict = "DO UPDATE SET {} RETURNING (xmax = 0)".format(
+            ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        )
+    else:
+        # every field is part of the key, so a conflicting row is already up to date
+        conflict = "DO NOTHING RETURNING true"
+    placeholders = "({})".format(", ".join(["%s"] * len(fields)))
+    sql = "INSERT INTO {} ({}) VALUES {} ON CONFLICT ({}) {}".format(
+        quote_name(django_model._meta.db_table),
+        ", ".join(quote_name(field.column) for field in fields),
+        ", ".join([placeholders] * len(rows)),
+        ", ".join(key_columns),
+        conflict,
+    )
+    params = [
+        field.get_db_prep_save(row.get(field.attname), connection)
+        for row in rows for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return sum(1 for (inserted,) in cursor.fetchall() if inserted)
+
+
+def ingest_rows(
+    django_model, rows, batch_size=None, use_copy=None, model_table=None, natural_key=None, first_row_number=1
+):
+    """
+    Validate and insert an iterable of rows in batches.
+    Invalid rows are skipped and reported, without aborting the rest of the load.
+    A batch that fails in the DB is rolled back on its own and reported as well.
+    Inserted rows are recorded on model_table, if given.
+    With a natural_key, rows are upserted instead, see upsert_rows.
+    Rows are numbered from first_row_number on in the reported errors.
+    A streamed upload which turns out to be malformed stops the load after the rows
+    read so far were written, and the parse error is reported at the row it hit.
+    """
+    batch_size = batch_size or getattr(settings, "DYNAMIC_MODEL_BULK_BATCH_SIZE", DEFAULT_BULK_BATCH_SIZE)
+    max_errors = getattr(settings, "DYNAMIC_MODEL_BULK_MAX_ERRORS", DEFAULT_BULK_MAX_ERRORS)
+    if use_copy is None:
+        use_copy = copy_available()
+    validators = get_row_validators(django_model)
+
+    written = "upserted" if natural_key else "inserted"
+    result = {written: 0, "error_count": 0, "errors": []}
+
+    def report(row_number, errors):
+        result["error_count"] += 1
+        if len(result["errors"]) < max_errors:
+            result["errors"].append({"row": row_number, "errors": errors})
+
+    parse_errors = []
+
+    def read_rows():
+        try:
+            yield from rows
+        except ParseError as e:
+            parse_errors.append(e)
+
+    last_row_number = first_row_number - 1
+    numbered_rows = enumerate(read_rows(), start=first_row_number)
+    for batch in batched(numbered_rows, batch_size):
+        last_row_number = batch[-1][0]
+        valid_rows = []
+        for row_number, row in batch:
+            values, errors = clean_row(row, validators)
+            if natural_key and not errors:
+                errors = get_natural_key_errors(values, natural_key)
+            if errors:
+                report(row_number, errors)
+            else:
+                valid_rows.append(values)
+        if not valid_rows:
+            continue
+
+        try:
+            with transaction.atomic():
+                if natural_key:
+                    new_rows = upsert_rows(django_model, valid_rows, natural_key)
+                else:
+                    insert_rows(django_model, valid_rows, use_copy=use_copy)
+                    new_rows = len(valid_rows)
+                if model_table is not None:
+                    model_table.mark_data_changed(row_delta=new_rows)
+        except DatabaseError as e:
+            first_row, last_row = batch[0][0], batch[-1][0]
+            report(f"{first_row}-{last_row}", {"non_field_errors": [str(e).strip()]})
+            continue
+        result[written] += len(valid_rows)
+
+    for e in parse_errors:
+        # reported even past max_errors, since no later rows were read
+        result["error_count"] += 1
+        result["errors"].append({"row": last_row_number + 1, "errors": {"non_field_errors": [str(e.detail)]}})
+    return result
+
+
+def encode_cursor(position):
+    """
+    Encode a keyset position into an opaque cursor string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_position(cursor):
+    """
+    Decode a cursor string made by encode_cursor, raising a ValueError if it's malformed.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor.")
+    return position
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor of rows, see split_page, raising a ValueError if it's malformed.
+    """
+    position = decode_position(cursor)
+    if not isinstance(position.get("pk"), int):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(position.setdefault("ordering", []), list):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(position.setdefault("values", []), list):
+        raise ValueError("Invalid cursor.")
+    return position
+
+
+def filter_rows(queryset, filters):
+    """
+    Apply (column, lookup, value) filters, as validated by DynamicModelRowsQuerySerializer.
+    """
+    return queryset.filter(*(
+        Q(**{f"{column}__{FILTER_LOOKUPS[lookup]}": value}) for column, lookup, value in filters
+    ))
+
+
+def update_rows(queryset, values, model_table=None):
+    """
+    Set the columns in values on every row of the queryset, with a single UPDATE statement.
+    Returns the number of updated rows, which are recorded on model_table, if given.
+    """
+    with transaction.atomic():
+        updated = queryset.update(**values)
+        if updated and model_table is not None:
+            model_table.mark_data_changed()
+    return updated
+
+
+def delete_rows(queryset, model_table=None):
+    """
+    Delete every row of the queryset, with a single DELETE statement.
+    Returns the number of deleted rows, which are recorded on model_table, if given.
+    """
+    with transaction.atomic():
+        # dynamic models have no relations or signal handlers,
+        # so Django deletes the rows without fetching them first
+        deleted, _ = queryset.delete()
+        if deleted and model_table is not None:
+            model_table.mark_data_changed(row_delta=-deleted)
+    return deleted
+
+
+def decode_group_cursor(cursor):
+    """
+    Decode a cursor of aggregated groups, see aggregate_rows, raising a ValueError if it's malformed.
+    """
+    position = decode_position(cursor)
+    group_by, values = position.get("group_by"), position.get("values")
+    if not isinstance(group_by, list) or not isinstance(values, list) or len(group_by) != len(values):
+        raise ValueError("Invalid cursor.")
+    return position
+
+
+def aggregate_rows(queryset, group_by, metrics, limit=None, cursor=None):
+    """
+    Compute (name, column, function) metrics over the rows, per group of the
+    group_by columns' values, with a single GROUP BY query.
+    'count' metrics without a column count rows. Groups are sorted by their values,
+    with NULLs last, and returned in pages of at most limit groups starting after
+    the cursor's group, along with the cursor of the next page (None on the last page).
+    """
+    annotations = {
+        name: AGGREGATE_FUNCTIONS[function](column or "pk") for name, column, function in metrics
+    }
+    if not group_by:
+        return [queryset.aggregate(**annotations)], None
+    keys = [(name, False) for name in group_by]
+    if cursor is not None:
+        # later groups are made of the rows which sort after the cursor's group
+        queryset = queryset.filter(after_values(keys, cursor["values"]))
+    queryset = queryset.values(*group_by).annotate(**annotations).order_by(
+        *(F(name).asc(nulls_last=True) for name in group_by)
+    )
+    if limit is None:
+        return list(queryset), None
+    groups = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(groups) > limit:
+        groups = groups[:limit]
+        next_cursor = encode_cursor({"group_by": group_by, "values": [groups[-1][name] for name in group_by]})
+    return groups, next_cursor
+
+
+def after_position(ordering, cursor):
+    """
+    Condition matching the rows which sort after the cursor's position,
+    ordered by ordering and then by primary key.
+    """
+    return after_values(list(ordering) + [("pk", False)], cursor["values"] + [cursor["pk"]])
+
+
+def after_values(keys, values):
+    """
+    Condition matching the rows which sort after the values of the (column, descending) keys.
+    Compares column by column, the way a row value comparison would, but
+    with mixed directions and NULLs sorting last.
+    """
+    condition = Q()
+    conditions = []
+    for (name, descending), value in zip(keys, values):
+        if value is not None:
+            after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            if name != "pk":
+                after |= Q(**{f"{name}__isnull": True})
+            conditions.append(condition & after)
+            condition &= Q(**{name: value})
+        else:
+            # nothing sorts after a NULL within its column
+            condition &= Q(**{f"{name}__isnull": True})
+    if not conditions:
+        # nothing sorts after all NULLs
+        return Q(pk__in=[])
+    return Q(*conditions, _connector=Q.OR)
+
+
+def format_ordering(ordering):
+    """
+    Render (column, descending) pairs the way the 'ordering' parameter spells them.
+    """
+    return [f"-{name}" if descending else name for name, descending in ordering]
+
+
+def seek_rows(queryset, cursor=None, ordering=()):
+    """
+    Order rows by the (column, descending) pairs in ordering, then by primary key,
+    starting after the cursor's position.
+    """
+    queryset = queryset.order_by(
+        *(F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True) for name, descending in ordering),
+        "pk",
+    )
+    if cursor is not None:
+        queryset = queryset.filter(after_position(ordering, cursor))
+    return queryset
+
+
+def get_selected_columns(column_names, ordering):
+    """
+    Columns to fetch for a page, including the ordering columns which the cursor needs.
+    """
+    ordering_columns = [name for name, _ in ordering if name not in column_names]
+    return ["pk", *column_names, *ordering_columns], ordering_columns
+
+
+def split_page(rows, limit, ordering=(), hidden=()):
+    """
+    Cut the extra row fetched past a page off, and turn it into the next page's cursor.
+    hidden are columns only fetched for the cursor, which are removed from the rows.
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_row = rows[-1]
+        position = {"pk": last_row["pk"]}
+        if ordering:
+            position["ordering"] = format_ordering(ordering)
+            position["values"] = [last_row[name] for name, _ in ordering]
+        next_cursor = encode_cursor(position)
+    for row in rows:
+        del row["pk"]
+        for name in hidden:
+            del row[name]
+    return rows, next_cursor
+
+
+def paginate_rows(queryset, column_names, limit, cursor=None, ordering=()):
+    """
+    Return a page of row values sorted by ordering and then by primary key, starting
+    after the cursor, along with the cursor of the next page (None on the last page).
+    Seeks past the previous page, so every page costs the same regardless of its depth.
+    """
+    selected, hidden = get_selected_columns(column_names, ordering)
+    queryset = seek_rows(queryset, cursor, ordering)
+    rows = list(queryset.values(*selected)[:limit + 1])
+    return split_page(rows, limit, ordering, hidden)
+
+
+async def apaginate_rows(queryset, column_names, limit, cursor=None, ordering=()):
+    """
+    Async version of paginate_rows.
+    """
+    selected, hidden = get_selected_columns(column_names, ordering)
+    queryset = seek_rows(queryset, cursor, ordering)
+    rows = [row async for row in queryset.values(*selected)[:limit + 1]]
+    return split_page(rows, limit, ordering, hidden)
+
+
+def stream_rows(queryset, column_names, cursor=None, chunk_size=None, ordering=()):
+    """
+    Yield rows sorted by ordering and then by primary key as newline delimited JSON.
+    Rows are read through a server-side cursor in chunks, so memory use
+    doesn't depend on the size of the table.
+    """
+    chunk_size = chunk_size or getattr(settings, "DYNAMIC_MODEL_ROWS_STREAM_CHUNK_SIZE", DEFAULT_STREAM_CHUNK_SIZE)
+    queryset = seek_rows(queryset, cursor, ordering)
+    for row in queryset.values(*column_names).iterator(chunk_size=chunk_size):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+async def astream_rows(queryset, column_names, cursor=None, chunk_size=None, ordering=()):
+    """
+    Async version of stream_rows. The next chunk is only fetched once
+    the client has read the previous one, without holding a thread meanwhile.
+    """
+    chunk_size = chunk_size or getattr(settings, "DYNAMIC_MODEL_ROWS_STREAM_CHUNK_SIZE", DEFAULT_STREAM_CHUNK_SIZE)
+    queryset = seek_rows(queryset, cursor, ordering)
+    async for row in queryset.values(*column_names).aiterator(chunk_size=chunk_size):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,339 @@
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from api.models import FieldType
+import time
+
+
+# SQLSTATE raised when a lock can't be taken within lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+# first key of the advisory locks serializing a table's schema changes, the second one is the table's id
+SCHEMA_CHANGE_LOCK = 7301
+
+# name prefix of the columns converted values are written to during online changes
+SHADOW_COLUMN_PREFIX = "__online_shadow_"
+
+
+# USING expressions converting a column's values between field types, keyed by
+# (current type, new type). '{column}' is replaced with the quoted column name.
+# Values which can't be converted become NULL.
+CAST_RULES = {
+    (FieldType.STRING, FieldType.NUMBER): (
+        "CASE WHEN {column} ~ '^\\s*[-+]?[0-9]+\\s*$' THEN "
+        "CASE WHEN trim({column})::numeric BETWEEN -2147483648 AND 2147483647 "
+        "THEN trim({column})::integer END END"
+    ),
+    (FieldType.STRING, FieldType.BOOLEAN): (
+        "CASE WHEN lower(trim({column})) IN ('t', 'true', 'y', 'yes', 'on') THEN true "
+        "WHEN lower(trim({column})) IN ('f', 'false', 'n', 'no', 'off') THEN false END"
+    ),
+    (FieldType.NUMBER, FieldType.STRING): "{column}::varchar(150)",
+    (FieldType.NUMBER, FieldType.BOOLEAN): "CASE {column} WHEN 1 THEN true WHEN 0 THEN false END",
+    (FieldType.BOOLEAN, FieldType.STRING): "CASE WHEN {column} THEN 'True' WHEN NOT {column} THEN 'False' END",
+    (FieldType.BOOLEAN, FieldType.NUMBER): "{column}::integer",
+}
+
+
+def get_cast_rule(current_type, new_type):
+    """
+    Return the USING expression template converting a column from one field type to another.
+    Rules from the DYNAMIC_MODEL_CAST_RULES setting take precedence over CAST_RULES.
+    Pairs without a rule are emptied.
+    """
+    rules = {**CAST_RULES, **getattr(settings, "DYNAMIC_MODEL_CAST_RULES", {})}
+    return rules.get((current_type, new_type), "NULL")
+
+
+def get_cast_expression(column, current_type, new_type):
+    """
+    Return the USING expression converting a quoted column from one field type to another.
+    """
+    return get_cast_rule(current_type, new_type).format(column=column)
+
+
+class SchemaDiff:
+    """
+    Difference between a dynamic model's current fields and the requested ones.
+    Fields missing from the request are left as they are.
+    """
+    def __init__(self, current, requested):
+        """
+        Both arguments map field names to FieldType values.
+        """
+        self.added = []
+        self.retyped = []
+        self.unchanged = []
+        for name, field_type in requested.items():
+            if name not in current:
+                self.added.append((name, field_type))
+            elif current[name] != field_type:
+                self.retyped.append((name, current[name], field_type))
+            else:
+                self.unchanged.append(name)
+
+    @property
+    def changed(self):
+        return bool(self.added or self.retyped)
+
+
+def alter_table(schema_editor, django_model, add_fields=(), alter_fields=(), drop_columns=()):
+    """
+    Apply column changes to a dynamic model's table with a single ALTER TABLE
+    statement, so the table is rewritten at most once for the whole batch.
+    alter_fields holds pairs of the new Django field and the USING expression
+    which converts the column's current values.
+    """
+    quote_name = schema_editor.quote_name
+    clauses, params = [], []
+    for column in drop_columns:
+        clauses.append(f"DROP COLUMN {quote_name(column)}")
+    for field in add_fields:
+        definition, definition_params = schema_editor.column_sql(django_model, field, include_default=False)
+        clauses.append(f"ADD COLUMN {quote_name(field.column)} {definition}")
+        params.extend(definition_params)
+    for field, using in alter_fields:
+        clauses.append(
+            f"ALTER COLUMN {quote_name(field.column)} TYPE {field.db_type(schema_editor.connection)} USING {using}"
+        )
+    if not clauses:
+        return
+    sql = "ALTER TABLE {} {}".format(quote_name(django_model._meta.db_table), ", ".join(clauses))
+    schema_editor.execute(sql, params or None)
+
+
+def count_unconvertible(schema_editor, django_model, conversions):
+    """
+    Count the values of each column which its USING expression turns into NULL,
+    with a single scan of the table. conversions maps column names to expressions.
+    """
+    if not conversions:
+        return {}
+    quote_name = schema_editor.quote_name
+    columns = list(conversions)
+    counts = ", ".join(
+        f"COUNT(*) FILTER (WHERE {quote_name(column)} IS NOT NULL AND ({conversions[column]}) IS NULL)"
+        for column in columns
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT {counts} FROM {quote_name(django_model._meta.db_table)}")
+        row = cursor.fetchone()
+    return dict(zip(columns, row))
+
+
+def create_index(schema_editor, django_model, table_index, concurrently=False):
+    """
+    Create a declared TableIndex. Concurrent creation doesn't block writes
+    to the table, but can't run inside a transaction.
+    """
+    quote_name = schema_editor.quote_name
+    sql = "CREATE {}INDEX {}IF NOT EXISTS {} ON {} ({})".format(
+        "UNIQUE " if table_index.unique else "",
+        "CONCURRENTLY " if concurrently else "",
+        quote_name(table_index.name),
+        quote_name(django_model._meta.db_table),
+        ", ".join(quote_name(column) for column in table_index.fields),
+    )
+    if table_index.condition:
+        sql += " WHERE " + " AND ".join(
+            "{} = {}".format(quote_name(column), "true" if value else "false")
+            for column, value in table_index.condition.items()
+        )
+    schema_editor.execute(sql)
+
+
+def drop_index(schema_editor, table_index, concurrently=False):
+    schema_editor.execute("DROP INDEX {}IF EXISTS {}".format(
+        "CONCURRENTLY " if concurrently else "",
+        schema_editor.quote_name(table_index.name),
+    ))
+
+
+def try_lock_schema_changes(table_id, session=False):
+    """
+    Take the advisory lock serializing a dynamic model table's schema changes, without waiting.
+    It's held until the transaction ends, or with session=True until unlock_schema_changes
+    is called, for changes spanning many transactions. Returns whether the lock was taken.
+    """
+    function = "pg_try_advisory_lock" if session else "pg_try_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {function}(%s, %s)", [SCHEMA_CHANGE_LOCK, table_id])
+        return cursor.fetchone()[0]
+
+
+def unlock_schema_changes(table_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [SCHEMA_CHANGE_LOCK, table_id])
+
+
+def is_lock_timeout(error):
+    """
+    Whether a DB error was raised because lock_timeout ran out.
+    """
+    cause = error.__cause__
+    # psycopg2 exposes the SQLSTATE as pgcode, psycopg 3 as sqlstate
+    code = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    return code == LOCK_NOT_AVAILABLE
+
+
+class OnlineSchemaChange:
+    """
+    Applies column changes to a dynamic model's table while it stays writable.
+    Every step that needs a lock on the table runs in its own short transaction
+    with a lock_timeout, and is retried with exponential backoff if the lock
+    can't be taken in time. New columns are nullable without a default, so
+    adding them doesn't rewrite the table. Retyped columns are filled through
+    shadow columns, which are backfilled in batches and kept in sync with
+    concurrent writes by a trigger, then swapped in for the old columns.
+    """
+    def __init__(self, django_model):
+        self.django_model = django_model
+        self.table = django_model._meta.db_table
+        self.lock_timeout = getattr(settings, "DYNAMIC_MODEL_ONLINE_LOCK_TIMEOUT", 2000)
+        self.lock_retries = getattr(settings, "DYNAMIC_MODEL_ONLINE_LOCK_RETRIES", 5)
+        self.retry_backoff = getattr(settings, "DYNAMIC_MODEL_ONLINE_RETRY_BACKOFF", 0.5)
+        self.batch_size = getattr(settings, "DYNAMIC_MODEL_ONLINE_BACKFILL_BATCH_SIZE", 10000)
+
+    def run_locked(self, operation):
+        """
+        Run operation(schema_editor) in a transaction with a lock_timeout,
+        retrying with exponential backoff while the table is locked by others.
+        """
+        for attempt in range(self.lock_retries + 1):
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"SET LOCAL lock_timeout = {int(self.lock_timeout)}")
+                    with connection.schema_editor(atomic=False) as schema_editor:
+                        return operation(schema_editor)
+            except OperationalError as e:
+                if not is_lock_timeout(e) or attempt == self.lock_retries:
+                    raise
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def shadow_column(self, index):
+        return f"{SHADOW_COLUMN_PREFIX}{index}"
+
+    @property
+    def sync_name(self):
+        """
+        Name of both the sync trigger and its function.
+        """
+        return f"{self.table}_online_sync"
+
+    def start_conversion(self, schema_editor, fields, conversions):
+        """
+        Add a shadow column per retyped field, and a trigger which fills them on every write.
+        fields are the new Django fields, conversions map their columns to USING
+        expressions formatted with a '{column}' placeholder.
+        """
+        quote_name = schema_editor.quote_name
+        shadow_fields = []
+        assignments = []
+        for index, field in enumerate(fields):
+            shadow = field.clone()
+            shadow.set_attributes_from_name(self.shadow_column(index))
+            shadow_fields.append(shadow)
+            expression = conversions[field.column].format(column="NEW." + quote_name(field.column))
+            assignments.append(f"NEW.{quote_name(shadow.column)} := {expression};")
+        alter_table(schema_editor, self.django_model, add_fields=shadow_fields)
+
+        schema_editor.execute(
+            f"CREATE OR REPLACE FUNCTION {quote_name(self.sync_name)}() RETURNS trigger AS $$ "
+            f"BEGIN {' '.join(assignments)} RETURN NEW; END; $$ LANGUAGE plpgsql"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {quote_name(self.sync_name)} BEFORE INSERT OR UPDATE ON {quote_name(self.table)} "
+            f"FOR EACH ROW EXECUTE FUNCTION {quote_name(self.sync_name)}()"
+        )
+
+    def backfill(self, fields, conversions):
+        """
+        Fill the shadow columns of existing rows in primary key batches,
+        each committed on its own, so row locks are only held briefly.
+        """
+        quote_name = connection.ops.quote_name
+        assignments = ", ".join(
+            "{} = {}".format(
+                quote_name(self.shadow_column(index)),
+                conversions[field.column].format(column=quote_name(field.column)),
+            )
+            for index, field in enumerate(fields)
+        )
+        pk_column = quote_name(self.django_model._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN({pk_column}), MAX({pk_column}) FROM {quote_name(self.table)}")
+            first_pk, last_pk = cursor.fetchone()
+        if first_pk is None:
+            return
+        for batch_start in range(first_pk, last_pk + 1, self.batch_size):
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {quote_name(self.table)} SET {assignments} "
+                        f"WHERE {pk_column} >= %s AND {pk_column} < %s",
+                        [batch_start, batch_start + self.batch_size],
+                    )
+
+    def count_unconverted(self, fields):
+        """
+        Count the values of each retyped column which their shadow column couldn't hold.
+        """
+        quote_name = connection.ops.quote_name
+        counts = ", ".join(
+            f"COUNT(*) FILTER (WHERE {quote_name(field.column)} IS NOT NULL "
+            f"AND {quote_name(self.shadow_column(index))} IS NULL)"
+            for index, field in enumerate(fields)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {counts} FROM {quote_name(self.table)}")
+            row = cursor.fetchone()
+        return {field.column: count for field, count in zip(fields, row)}
+
+    def drop_sync_trigger(self, schema_editor):
+        quote_name = schema_editor.quote_name
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {quote_name(self.sync_name)} ON {quote_name(self.table)}")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {quote_name(self.sync_name)}()")
+
+    def remove_leftovers(self, schema_editor):
+        """
+        Drop the sync trigger and shadow columns of a conversion which was interrupted,
+        e.g. by a crash, before it finished or was aborted.
+        """
+        quote_name = schema_editor.quote_name
+        with schema_editor.connection.cursor() as cursor:
+            # a single catalog lookup, so tables without leftovers are cheap to check
+            cursor.execute(
+                "SELECT to_regprocedure(%s) IS NOT NULL, ARRAY(SELECT attname FROM pg_attribute "
+                "WHERE attrelid = %s::regclass AND starts_with(attname, %s) AND NOT attisdropped)",
+                [f"{quote_name(self.sync_name)}()", quote_name(self.table), SHADOW_COLUMN_PREFIX],
+            )
+            has_sync_function, shadow_columns = cursor.fetchone()
+        if has_sync_function:
+            # the trigger can't outlive its function
+            self.drop_sync_trigger(schema_editor)
+        alter_table(schema_editor, self.django_model, drop_columns=shadow_columns)
+
+    def finish_conversion(self, schema_editor, fields):
+        """
+        Drop the sync trigger and the old columns, and rename the shadow columns in their place.
+        Only touches the catalog, so the table lock is held very briefly.
+        """
+        quote_name = schema_editor.quote_name
+        self.drop_sync_trigger(schema_editor)
+        alter_table(schema_editor, self.django_model, drop_columns=[field.column for field in fields])
+        for index, field in enumerate(fields):
+            schema_editor.execute(
+                f"ALTER TABLE {quote_name(self.table)} "
+                f"RENAME COLUMN {quote_name(self.shadow_column(index))} TO {quote_name(field.column)}"
+            )
+
+    def abort_conversion(self, schema_editor, fields):
+        """
+        Drop the sync trigger and the shadow columns of an unfinished conversion.
+        """
+        self.drop_sync_trigger(schema_editor)
+        alter_table(
+            schema_editor,
+            self.django_model,
+            drop_columns=[self.shadow_column(index) for index in range(len(fields))],
+        )
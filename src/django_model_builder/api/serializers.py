@@ -1,12 +1,47 @@
-from django.db import models, connection
+from django.conf import settings
+from django.db import models, connection, transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from uuid import uuid4
-from api.models import FieldType, DynamicModelTable, App, Field
+from api.models import FieldType, DynamicModelTable, App, Field, Job, RowCountMode, TableIndex
+from api.registry import model_registry
+from api.rows import (
+    AGGREGATE_FUNCTIONS,
+    FIELD_TYPE_LOOKUPS,
+    clean_row,
+    decode_cursor,
+    decode_group_cursor,
+    format_ordering,
+    get_column_types,
+    get_natural_key_errors,
+    get_row_validators,
+    update_rows,
+    upsert_rows,
+)
+from api.schema import (
+    OnlineSchemaChange,
+    SchemaDiff,
+    alter_table,
+    count_unconvertible,
+    create_index,
+    drop_index,
+    get_cast_expression,
+    get_cast_rule,
+    is_lock_timeout,
+    try_lock_schema_changes,
+    unlock_schema_changes,
+)
+import contextlib
 import types
-from django.db.utils import DataError
+from django.db.utils import DatabaseError, DataError, OperationalError
 from drf_spectacular.utils import extend_schema_serializer, OpenApiExample
 
 
+# error of table updates which find another one still running
+SCHEMA_CHANGE_IN_PROGRESS = "Another schema change of the table is in progress, try again later."
+
+
 def create_serializer_for_model(dj_model):
     """
     Given a Django model, construct a ModelSerializer for it.
@@ -22,66 +57,480 @@ def create_serializer_for_model(dj_model):
     return result
 
 
+class DynamicModelIndexSerializer(serializers.Serializer):
+    """
+    Secondary index declaration.
+    """
+    # indexed field names, in index order
+    fields = serializers.ListField(child=serializers.CharField(), min_length=1)
+    unique = serializers.BooleanField(required=False, default=False)
+    # BOOL field names mapped to the value of the rows to index, for a partial index
+    condition = serializers.DictField(child=serializers.BooleanField(), required=False, default=dict)
+
+    def validate_fields(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Index fields must be unique.")
+        return value
+
+
+def get_natural_key_index(natural_key):
+    """
+    Declaration of the unique index which enforces a natural key, or None without one.
+    """
+    if not natural_key:
+        return None
+    return {"fields": list(natural_key), "unique": True, "condition": {}}
+
+
+def build_table_indexes(model_table, indexes):
+    """
+    Build unsaved TableIndex objects from index declarations.
+    Repeated declarations of the same index are only built once.
+    """
+    table_indexes = {}
+    for index in indexes:
+        name = TableIndex.make_name(model_table.model_id, index["fields"], index["unique"], index["condition"])
+        table_indexes[name] = TableIndex(
+            model=model_table,
+            name=name,
+            fields=index["fields"],
+            unique=index["unique"],
+            condition=index["condition"],
+        )
+    return list(table_indexes.values())
+
+
+def create_model_tables(declarations):
+    """
+    Register dynamic models and create their tables. Each declaration holds the
+    'model_id' and 'fields', and optionally 'indexes' and a 'natural_key'.
+    The metadata is written first, with one bulk insert per kind of row, so each
+    table is created with a single CREATE TABLE statement holding all of its columns,
+    followed by its indexes. New tables are empty, so their indexes are built right away.
+    Meant to run in a transaction. Returns the DynamicModelTable objects.
+    """
+    app = App.objects.first()
+    # the tables are created in the same transaction
+    model_tables = DynamicModelTable.objects.bulk_create([
+        DynamicModelTable(
+            model_id=declaration["model_id"],
+            app=app,
+            natural_key=list(declaration.get("natural_key") or []),
+            materialized=True,
+        )
+        for declaration in declarations
+    ])
+    table_fields, table_indexes = [], []
+    for model_table, declaration in zip(model_tables, declarations):
+        table_fields.append([
+            Field(model=model_table, name=name, field_type=field_type)
+            for name, field_type in declaration["fields"].items()
+        ])
+        indexes = list(declaration.get("indexes") or [])
+        natural_key_index = get_natural_key_index(declaration.get("natural_key"))
+        if natural_key_index:
+            indexes.append(natural_key_index)
+        table_indexes.append(build_table_indexes(model_table, indexes))
+    Field.objects.bulk_create([field for fields in table_fields for field in fields])
+    TableIndex.objects.bulk_create([table_index for indexes in table_indexes for table_index in indexes])
+
+    with connection.schema_editor() as schema_editor:
+        for model_table, fields, indexes in zip(model_tables, table_fields, table_indexes):
+            # built from the rows just written, so no fields or indexes are queried
+            django_model = model_table.build_django_model(fields, indexes)
+            schema_editor.create_model(django_model)
+            model_registry.set(model_table.model_id, model_table.schema_version, django_model)
+    return model_tables
+
+
 class DynamicModelSerializer(serializers.Serializer):
     # Dynamic model fields with the available value choices being FieldType choices
     fields = serializers.DictField(child=serializers.ChoiceField(required=True, choices=FieldType))
-    
+    indexes = serializers.ListField(child=DynamicModelIndexSerializer(), required=False)
+    # field names identifying a row for upserts, only declared when the table is created
+    natural_key = serializers.ListField(child=serializers.CharField(), required=False, min_length=1)
+
+    def validate_natural_key(self, value):
+        if self.context.get("model_id") is not None:
+            raise serializers.ValidationError("The natural key can only be declared when the table is created.")
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Natural key fields must be unique.")
+        return value
+
+    def validate(self, attrs):
+        """
+        Check that the natural key and indexes only refer to the model's fields,
+        and that indexes filter on BOOL fields only.
+        """
+        unknown = [name for name in attrs.get("natural_key", []) if name not in attrs.get("fields", {})]
+        if unknown:
+            raise serializers.ValidationError({
+                "natural_key": ["Field '{}' not found in model.".format(name) for name in unknown]
+            })
+        indexes = attrs.get("indexes")
+        if not indexes:
+            return attrs
+        field_types = {}
+        model_id = self.context.get("model_id")
+        if model_id is not None:
+            field_types.update(Field.objects.filter(model__model_id=model_id).values_list("name", "field_type"))
+        field_types.update(attrs.get("fields", {}))
+
+        errors = {}
+        for position, index in enumerate(indexes):
+            messages = [
+                "Field '{}' not found in model.".format(name)
+                for name in [*index["fields"], *index["condition"]]
+                if name not in field_types
+            ]
+            messages += [
+                "Index condition field '{}' is not a BOOL field.".format(name)
+                for name in index["condition"]
+                if name in field_types and field_types[name] != FieldType.BOOLEAN
+            ]
+            if messages:
+                errors[position] = messages
+        if errors:
+            raise serializers.ValidationError({"indexes": errors})
+        return attrs
+
     def create(self, validated_data):
         # create a UUID which will serve as the model name
-        model_id = str(uuid4())
-        fields_data = validated_data.get('fields', {}).items()
-        model = self.register_model(model_id, fields_data)
-        return {"model_id": model_id}
-    
-    def register_model(self, model_id, model_fields):
-        # construct a DynamicModelTable object to keep a reference to the model
-        model = DynamicModelTable.objects.create(model_id=model_id, app=App.objects.first())
-        # Construct the corresponding Django model and save it in the DB if necessary
-        django_model = model.get_django_model()
-        with connection.schema_editor() as schema_editor:
-            # create and save the model fields
-            for field_name, field_type in model_fields:
-                # Field objects
-                field = Field.objects.create(model=model, name=field_name, field_type=field_type)
-                # Corresponding DB fields
-                django_field_for_db = field.get_django_field()
-                django_field_for_db.column = field_name
-                schema_editor.add_field(django_model, django_field_for_db)
+        model_id = uuid4()
+        self.register_model(
+            model_id,
+            validated_data.get('fields', {}).items(),
+            validated_data.get('indexes', []),
+            validated_data.get('natural_key', []),
+        )
+        return {"model_id": str(model_id)}
+
+    @transaction.atomic
+    def register_model(self, model_id, model_fields, indexes=(), natural_key=()):
+        """
+        Register the model and create its table, columns and indexes included.
+        """
+        [model] = create_model_tables([{
+            "model_id": model_id,
+            "fields": dict(model_fields),
+            "indexes": indexes,
+            "natural_key": natural_key,
+        }])
         return model
-    
-    def update_model(self, model_id):
+
+    def update_model(self, model_id, online=False):
         """
-        Update a given model with the provided fields.
+        Update a given model with the provided fields and indexes.
         Adds new fields.
         Existing fields are not touched unless there was a data type change.
-        In that case, the field is replaces with a new one, with the new data type.
+        In that case, the column is converted to the new data type in place.
+        Values which can't be converted are set to NULL, and counted per field in the result.
+        The field changes and the schema version bump are committed together.
+        In online mode the table stays writable during the change, see OnlineSchemaChange.
+        New indexes are built once the schema change is committed.
         """
+        if online:
+            result, model_table, new_indexes = self._update_model_online(model_id)
+        else:
+            with transaction.atomic():
+                result, model_table, new_indexes = self._update_model(model_id)
+        return self.add_index_errors(result, self.create_indexes(model_table, new_indexes))
+
+    def _update_model(self, model_id):
         try:
-            model_to_be_updated = DynamicModelTable.objects.get(model_id=model_id)
+            # lock the row so that concurrent updates of the same model are serialized
+            model_to_be_updated = DynamicModelTable.objects.select_for_update().get(model_id=model_id)
         except DynamicModelTable.DoesNotExist:
-            return {"error": f"Could not find model with ID of {model_id}."}
-        
-        current_model_fields = model_to_be_updated.fields
-        fields_data = self.validated_data.get('fields', {}).items()
+            return {"error": f"Could not find model with ID of {model_id}."}, None, []
+        # online changes don't hold the row lock, see _update_model_online
+        if not try_lock_schema_changes(model_to_be_updated.pk):
+            return {"error": SCHEMA_CHANGE_IN_PROGRESS}, None, []
+
+        diff = self.get_schema_diff(model_to_be_updated)
+        # only retyped fields are checked against the indexes
+        table_indexes = list(model_to_be_updated.indexes.all()) if diff.retyped else []
+        self.check_index_conditions(table_indexes, diff)
+        self.check_natural_key(model_to_be_updated, diff)
+        self.check_unique_indexes(table_indexes, diff)
+        new_indexes = self.save_indexes(model_to_be_updated, self.validated_data.get("indexes", []))
+        if not diff.changed:
+            if new_indexes:
+                model_to_be_updated.bump_schema_version()
+            return {"model_id": model_id}, model_to_be_updated, new_indexes
+
+        django_model = model_to_be_updated.get_django_model()
+        new_fields, retyped_fields = self.save_fields(model_to_be_updated, diff)
 
         with connection.schema_editor() as schema_editor:
-            django_model = model_to_be_updated.get_django_model()
-            # Go over the provided fields and add/update the model's fields accordingly
-            for name, field in fields_data:
-                # if editing existing field, remove it first, only if field type changed
-                if (name,) in current_model_fields.values_list("name"):
-                    field_type_changed = current_model_fields.get(name=name).field_type != field
-                    if not field_type_changed:
-                        continue
-                    Field.objects.filter(model=model_to_be_updated, name=name).delete()
-                    schema_editor.remove_field(django_model, getattr(django_model, name).field)
-
-                # create new field if adding column or changing existing one's data type
-                new_field = Field.objects.create(model=model_to_be_updated, name=name, field_type=field)
-                django_field_for_db = new_field.get_django_field()
-                django_field_for_db.column = name
-                schema_editor.add_field(django_model, django_field_for_db)
-        return {"model_id": model_id}
+            # an interrupted online change would keep syncing the columns with their old types
+            OnlineSchemaChange(django_model).remove_leftovers(schema_editor)
+            # retyped columns are converted in place, values which don't fit the new type become NULL
+            conversions = {
+                name: get_cast_expression(schema_editor.quote_name(name), current_type, field_type)
+                for name, current_type, field_type in diff.retyped
+            }
+            nulled_values = count_unconvertible(schema_editor, django_model, conversions)
+            alter_table(
+                schema_editor,
+                django_model,
+                add_fields=[self.get_db_field(field) for field in new_fields],
+                alter_fields=[(self.get_db_field(field), conversions[field.name]) for field in retyped_fields],
+            )
+        # invalidate classes built from the old schema in every worker
+        model_to_be_updated.bump_schema_version()
+        return self.get_update_result(model_id, nulled_values), model_to_be_updated, new_indexes
+
+    def _update_model_online(self, model_id):
+        try:
+            model_to_be_updated = DynamicModelTable.objects.get(model_id=model_id)
+        except DynamicModelTable.DoesNotExist:
+            return {"error": f"Could not find model with ID of {model_id}."}, None, []
+        # the change spans many transactions, so it holds a session lock
+        # until it's done, rather than a lock on the table's row
+        if not try_lock_schema_changes(model_to_be_updated.pk, session=True):
+            return {"error": SCHEMA_CHANGE_IN_PROGRESS}, None, []
+        try:
+            # another change may have committed before the lock was taken
+            model_to_be_updated.refresh_from_db()
+            return self._change_schema_online(model_to_be_updated)
+        finally:
+            unlock_schema_changes(model_to_be_updated.pk)
+
+    def _change_schema_online(self, model_to_be_updated):
+        model_id = model_to_be_updated.model_id
+        diff = self.get_schema_diff(model_to_be_updated)
+        # only retyped fields are checked against the indexes
+        table_indexes = list(model_to_be_updated.indexes.all()) if diff.retyped else []
+        self.check_index_conditions(table_indexes, diff)
+        self.check_natural_key(model_to_be_updated, diff)
+        self.check_unique_indexes(table_indexes, diff)
+        if not diff.changed:
+            with transaction.atomic():
+                new_indexes = self.save_indexes(model_to_be_updated, self.validated_data.get("indexes", []))
+                if new_indexes:
+                    model_to_be_updated.bump_schema_version()
+            return {"model_id": model_id}, model_to_be_updated, new_indexes
+
+        django_model = model_to_be_updated.get_django_model()
+        schema_change = OnlineSchemaChange(django_model)
+        retyped = [
+            (self.get_db_field(Field(name=name, field_type=field_type)), get_cast_rule(current_type, field_type))
+            for name, current_type, field_type in diff.retyped
+        ]
+        retyped_db_fields = [field for field, _ in retyped]
+        conversions = {field.column: rule for field, rule in retyped}
+
+        def add_columns(schema_editor):
+            schema_change.remove_leftovers(schema_editor)
+            # new nullable columns without a default only touch the catalog
+            new_fields = Field.objects.bulk_create([
+                Field(model=model_to_be_updated, name=name, field_type=field_type)
+                for name, field_type in diff.added
+            ])
+            alter_table(schema_editor, django_model, add_fields=[self.get_db_field(field) for field in new_fields])
+            if retyped:
+                schema_change.start_conversion(schema_editor, retyped_db_fields, conversions)
+            new_indexes = self.save_indexes(model_to_be_updated, self.validated_data.get("indexes", []))
+            if new_fields or new_indexes:
+                model_to_be_updated.bump_schema_version()
+            return new_indexes
+
+        def swap_columns(schema_editor):
+            schema_change.finish_conversion(schema_editor, retyped_db_fields)
+            new_types = {name: field_type for name, _, field_type in diff.retyped}
+            retyped_fields = list(Field.objects.filter(model=model_to_be_updated, name__in=new_types))
+            for field in retyped_fields:
+                field.field_type = new_types[field.name]
+            Field.objects.bulk_update(retyped_fields, ["field_type"])
+            model_to_be_updated.bump_schema_version()
+
+        try:
+            new_indexes = schema_change.run_locked(add_columns)
+            nulled_values = {}
+            if retyped:
+                try:
+                    schema_change.backfill(retyped_db_fields, conversions)
+                    nulled_values = schema_change.count_unconverted(retyped_db_fields)
+                    schema_change.run_locked(swap_columns)
+                except Exception:
+                    # leave the table as it was before the conversion started
+                    schema_change.run_locked(
+                        lambda schema_editor: schema_change.abort_conversion(schema_editor, retyped_db_fields)
+                    )
+                    raise
+        except OperationalError as e:
+            if not is_lock_timeout(e):
+                raise
+            return {"error": "Timed out waiting for a lock on the table, try again later."}, None, []
+        # indexes on the swapped columns went away with the old columns
+        retyped_names = {field.column for field in retyped_db_fields}
+        if retyped_names:
+            new_indexes = [
+                table_index for table_index in model_to_be_updated.indexes.all()
+                if table_index in new_indexes or retyped_names & set(table_index.fields)
+            ]
+        return self.get_update_result(model_id, nulled_values), model_to_be_updated, new_indexes
+
+    def get_schema_diff(self, model_table):
+        """
+        Compare the requested fields with the model's current ones, fetched with a single query.
+        """
+        prefetch_related_objects([model_table], "fields")
+        return SchemaDiff(
+            {field.name: field.field_type for field in model_table.fields.all()},
+            self.validated_data.get('fields', {}),
+        )
+
+    def save_fields(self, model_table, diff):
+        """
+        Write the Field rows of a schema diff with one query per kind of change.
+        Returns the new and the retyped Field objects.
+        """
+        current_model_fields = {field.name: field for field in model_table.fields.all()}
+        new_fields = Field.objects.bulk_create([
+            Field(model=model_table, name=name, field_type=field_type)
+            for name, field_type in diff.added
+        ])
+        retyped_fields = []
+        for name, _, field_type in diff.retyped:
+            field = current_model_fields[name]
+            field.field_type = field_type
+            retyped_fields.append(field)
+        Field.objects.bulk_update(retyped_fields, ["field_type"])
+        return new_fields, retyped_fields
+
+    def get_update_result(self, model_id, nulled_values):
+        result = {"model_id": model_id}
+        nulled_values = {name: count for name, count in nulled_values.items() if count}
+        if nulled_values:
+            result["nulled_values"] = nulled_values
+        return result
+
+    def check_index_conditions(self, table_indexes, diff):
+        """
+        Partial indexes filter on BOOL fields, which therefore can't change type.
+        """
+        retyped = {name for name, current_type, _ in diff.retyped if current_type == FieldType.BOOLEAN}
+        if not retyped:
+            return
+        used = set()
+        for table_index in table_indexes:
+            used |= retyped & set(table_index.condition)
+        if used:
+            raise serializers.ValidationError({
+                "fields": ["Field '{}' is used in an index condition.".format(name) for name in sorted(used)]
+            })
+
+    def check_natural_key(self, model_table, diff):
+        """
+        Natural key fields can't change type, since converted values may collide,
+        which would break the key's unique index.
+        """
+        retyped = sorted({name for name, _, _ in diff.retyped} & set(model_table.natural_key))
+        if retyped:
+            raise serializers.ValidationError({
+                "fields": ["Field '{}' is part of the natural key.".format(name) for name in retyped]
+            })
+
+    def check_unique_indexes(self, table_indexes, diff):
+        """
+        Fields covered by a unique index can't change type either, since distinct values
+        may convert to the same one, e.g. 'yes' and 'true' both become true.
+        """
+        retyped = {name for name, _, _ in diff.retyped}
+        errors = [
+            "Field '{}' is covered by the unique index '{}'.".format(name, table_index.name)
+            for table_index in table_indexes if table_index.unique
+            for name in table_index.fields if name in retyped
+        ]
+        if errors:
+            raise serializers.ValidationError({"fields": errors})
+
+    def save_indexes(self, model_table, indexes):
+        """
+        Store the declared indexes which the model doesn't have yet.
+        Returns the new TableIndex objects.
+        """
+        if not indexes:
+            return []
+        existing = set(model_table.indexes.values_list("name", flat=True))
+        return TableIndex.objects.bulk_create([
+            table_index for table_index in build_table_indexes(model_table, indexes)
+            if table_index.name not in existing
+        ])
+
+    def create_indexes(self, model_table, table_indexes):
+        """
+        Build indexes on the model's table. Outside of a transaction they're built
+        concurrently, so the table stays writable meanwhile. Indexes which can't be
+        built, e.g. unique ones over duplicate values, are dropped again.
+        Returns the failed TableIndex objects mapped to their error.
+        """
+        if not table_indexes:
+            return {}
+        django_model = model_table.get_django_model()
+        concurrently = not connection.in_atomic_block
+        errors = {}
+        for table_index in table_indexes:
+            try:
+                # inside a transaction, a failed index mustn't abort the rest of it
+                with contextlib.nullcontext() if concurrently else transaction.atomic():
+                    with connection.schema_editor(atomic=False) as schema_editor:
+                        create_index(schema_editor, django_model, table_index, concurrently=concurrently)
+            except DatabaseError as e:
+                if concurrently:
+                    # a failed concurrent build leaves an invalid index behind
+                    with connection.schema_editor(atomic=False) as schema_editor:
+                        drop_index(schema_editor, table_index, concurrently=True)
+                errors[table_index] = str(e).strip()
+        if errors:
+            TableIndex.objects.filter(pk__in=[table_index.pk for table_index in errors]).delete()
+            model_table.bump_schema_version()
+        return errors
+
+    def add_index_errors(self, result, index_errors):
+        if index_errors:
+            result["index_errors"] = [
+                {
+                    "fields": table_index.fields,
+                    "unique": table_index.unique,
+                    "condition": table_index.condition,
+                    "error": error,
+                }
+                for table_index, error in index_errors.items()
+            ]
+        return result
+
+    def get_db_field(self, field):
+        """
+        Build the Django model field which backs a Field object's column.
+        """
+        django_field_for_db = field.get_django_field()
+        django_field_for_db.set_attributes_from_name(field.name)
+        return django_field_for_db
+
+
+class DynamicModelBatchSerializer(serializers.Serializer):
+    """
+    Declarations of many dynamic models, created together.
+    """
+    tables = serializers.ListField(child=DynamicModelSerializer(), min_length=1)
+
+    def validate_tables(self, value):
+        max_tables = settings.DYNAMIC_MODEL_BATCH_MAX_TABLES
+        if len(value) > max_tables:
+            raise serializers.ValidationError(f"Ensure this field has no more than {max_tables} elements.")
+        return value
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """
+        Create every declared model, or none of them.
+        """
+        model_tables = create_model_tables([
+            {**declaration, "model_id": uuid4()} for declaration in validated_data["tables"]
+        ])
+        return {"model_ids": [str(model_table.model_id) for model_table in model_tables]}
 
 
 class DynamicModelRowSerializer(serializers.Serializer):
@@ -89,17 +538,39 @@ class DynamicModelRowSerializer(serializers.Serializer):
 
     def validate_fields(self, value):
         """
-        Check if all provided fields exist in the targeted model.
+        Check that the row is an object of column values.
+        """
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object of column values.")
+        if self.instance is not None and not value:
+            raise serializers.ValidationError("Expected at least one column value to update.")
+        return value
+
+    def validate(self, attrs):
+        """
+        Check if all provided fields exist in the targeted model, and that their
+        values fit the field types, in a single pass over the row.
+        Checked against the cached model class, so no model fields are queried.
         """
         model_table = self.context.get("model_table", None)
         if not model_table:
             raise serializers.ValidationError("This serializer needs a model table object.")
-        
-        django_model_fields = model_table.fields.all()
-        for field_name, field_val in value.items():
-            if not django_model_fields.filter(name=field_name).exists():
-                raise serializers.ValidationError("Field '{}' not found in model.".format(field_name))
-        return value
+
+        # async views pass the model class they already resolved
+        django_model = self.context.get("django_model") or model_table.get_django_model()
+        validators = get_row_validators(django_model)
+        values, errors = clean_row(attrs["fields"], validators)
+        unknown_fields = [messages[0] for name, messages in errors.items() if name not in validators]
+        if unknown_fields:
+            raise serializers.ValidationError({"fields": unknown_fields})
+        if not errors and self.context.get("upsert"):
+            if not model_table.natural_key:
+                raise serializers.ValidationError({"error": ["The table has no natural key to upsert rows by."]})
+            errors = get_natural_key_errors(values, model_table.natural_key)
+        if errors:
+            raise serializers.ValidationError({"error": [message for messages in errors.values() for message in messages]})
+        attrs["fields"] = values
+        return attrs
     
     def create(self, validated_data):
         """
@@ -116,7 +587,292 @@ class DynamicModelRowSerializer(serializers.Serializer):
         # Try to insert the data row
         fields_data = validated_data.get('fields', {})
         try:
-            new_row = django_model.objects.create(**fields_data)
+            with transaction.atomic():
+                if self.context.get("upsert"):
+                    new_rows = upsert_rows(django_model, [fields_data], model_table.natural_key)
+                    model_table.mark_data_changed(row_delta=new_rows)
+                else:
+                    new_row = django_model.objects.create(**fields_data)
+                    model_table.mark_data_changed(row_delta=1)
         except Exception as e:
-            return {"error": e.messages}
+            return {"error": getattr(e, "messages", [str(e)])}
         return {"model_id": model_id}
+
+    def update(self, instance, validated_data):
+        """
+        Set the given column values on a queryset of the table's rows.
+        """
+        model_table = self.context.get("model_table", None)
+        if not model_table:
+            raise serializers.ValidationError("This serializer needs a model table object.")
+        try:
+            updated = update_rows(instance, validated_data["fields"], model_table=model_table)
+        except Exception as e:
+            return {"error": getattr(e, "messages", [str(e)])}
+        return {"updated": updated}
+
+
+class DynamicModelJobQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the views which can queue their operation as a job.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        # 'async' is a reserved word, so it can't be declared as a class attribute
+        fields["async"] = serializers.BooleanField(required=False, default=False)
+        return fields
+
+
+class DynamicModelAddRowQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the row insertion view.
+    """
+    # replace the row with the same natural key, if there is one
+    upsert = serializers.BooleanField(required=False, default=False)
+
+
+class DynamicModelBulkRowsQuerySerializer(DynamicModelJobQuerySerializer, DynamicModelAddRowQuerySerializer):
+    """
+    Query parameters of the bulk row insertion view.
+    """
+    batch_size = serializers.IntegerField(required=False, min_value=1, max_value=100000)
+
+
+class DynamicModelRowFiltersSerializer(serializers.Serializer):
+    """
+    Base of query parameter serializers which filter a table's rows.
+    Any parameter which isn't declared is a row filter, named '<column>' or '<column>__<lookup>'.
+    Columns are checked against the model class given as the 'django_model' context.
+    """
+    # parsers of filter values per field type
+    value_fields = {
+        FieldType.STRING: serializers.CharField(allow_blank=True, trim_whitespace=False),
+        FieldType.NUMBER: serializers.IntegerField(),
+        FieldType.BOOLEAN: serializers.BooleanField(),
+    }
+
+    @property
+    def column_types(self):
+        return get_column_types(self.context["django_model"])
+
+    def validate(self, attrs):
+        attrs["filters"] = self.get_filters()
+        return attrs
+
+    def get_filters(self):
+        """
+        Parse the filter parameters into (column, lookup, value) tuples.
+        """
+        filters, errors = [], {}
+        for param, raw_values in self.initial_data.lists():
+            if param in self.fields or param == api_settings.URL_FORMAT_OVERRIDE:
+                continue
+            column, _, lookup = param.partition("__")
+            lookup = lookup or "eq"
+            field_type = self.column_types.get(column)
+            if field_type is None:
+                errors[param] = [f"Field '{column}' not found in model."]
+            elif lookup not in FIELD_TYPE_LOOKUPS[field_type]:
+                errors[param] = [f"Lookup '{lookup}' is not supported on {field_type.label} fields."]
+            else:
+                try:
+                    for raw_value in raw_values:
+                        filters.append((column, lookup, self.parse_filter_value(column, lookup, raw_value)))
+                except serializers.ValidationError as e:
+                    errors[param] = e.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+        return filters
+
+    def parse_filter_value(self, column, lookup, raw_value):
+        if lookup == "isnull":
+            return serializers.BooleanField().run_validation(raw_value)
+        if lookup == "in":
+            return [self.parse_value(column, value) for value in raw_value.split(",")]
+        return self.parse_value(column, raw_value)
+
+    def parse_value(self, column, value):
+        return self.value_fields[self.column_types[column]].run_validation(value)
+
+    def split_names(self, value):
+        return [name.strip() for name in value.split(",") if name.strip()]
+
+    def validate_limit(self, value):
+        max_limit = settings.DYNAMIC_MODEL_ROWS_MAX_PAGE_SIZE
+        if value > max_limit:
+            raise serializers.ValidationError(f"Ensure this value is less than or equal to {max_limit}.")
+        return value
+
+
+class DynamicModelRowsQuerySerializer(DynamicModelRowFiltersSerializer):
+    """
+    Query parameters of the get rows view.
+    """
+    limit = serializers.IntegerField(required=False, min_value=1)
+    cursor = serializers.CharField(required=False)
+    stream = serializers.BooleanField(required=False, default=False)
+    # comma separated column names, prefixed with '-' for descending order in 'ordering'
+    fields = serializers.CharField(required=False)
+    ordering = serializers.CharField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate_fields(self, value):
+        names = self.split_names(value)
+        unknown = [name for name in names if name not in self.column_types]
+        if unknown:
+            raise serializers.ValidationError([f"Field '{name}' not found in model." for name in unknown])
+        return list(dict.fromkeys(names))
+
+    def validate_ordering(self, value):
+        ordering = []
+        for name in self.split_names(value):
+            descending = name.startswith("-")
+            name = name.lstrip("-")
+            if name not in self.column_types:
+                raise serializers.ValidationError(f"Field '{name}' not found in model.")
+            ordering.append((name, descending))
+        return ordering
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        attrs.setdefault("ordering", [])
+
+        cursor = attrs.get("cursor")
+        if cursor is not None:
+            # a cursor only points into the ordering it was made for
+            if cursor["ordering"] != format_ordering(attrs["ordering"]) or len(cursor["values"]) != len(attrs["ordering"]):
+                raise serializers.ValidationError({"cursor": ["Invalid cursor."]})
+            try:
+                cursor["values"] = [
+                    self.parse_value(name, value) if value is not None else None
+                    for (name, _), value in zip(attrs["ordering"], cursor["values"])
+                ]
+            except serializers.ValidationError:
+                raise serializers.ValidationError({"cursor": ["Invalid cursor."]})
+        return attrs
+
+
+class DynamicModelRowChangesQuerySerializer(DynamicModelRowFiltersSerializer):
+    """
+    Query parameters of the views which update or delete the rows matched by filters.
+    """
+    # changing every row has to be asked for, rather than following from missing filters
+    all = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if not attrs["filters"] and not attrs["all"]:
+            raise serializers.ValidationError("Pass filters, or 'all=true' to change every row.")
+        return attrs
+
+
+class DynamicModelCountQuerySerializer(DynamicModelRowFiltersSerializer):
+    """
+    Query parameters of the row count view.
+    """
+    mode = serializers.ChoiceField(choices=RowCountMode, required=False)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if attrs["filters"]:
+            attrs.setdefault("mode", RowCountMode.EXACT)
+            if attrs["mode"] != RowCountMode.EXACT:
+                raise serializers.ValidationError({"mode": ["Only exact counts can be filtered."]})
+        attrs.setdefault("mode", settings.DYNAMIC_MODEL_ROW_COUNT_MODE or RowCountMode.EXACT)
+        return attrs
+
+
+class DynamicModelAggregateQuerySerializer(DynamicModelRowFiltersSerializer):
+    """
+    Query parameters of the aggregate view.
+    """
+    # comma separated STR and BOOL columns
+    group_by = serializers.CharField(required=False)
+    # comma separated 'count' and '<NUM column>__<function>' metrics
+    metrics = serializers.CharField()
+    limit = serializers.IntegerField(required=False, min_value=1)
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_group_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        cursor = attrs.get("cursor")
+        if cursor is not None:
+            # a cursor only points into the groups it was made for
+            group_by = attrs.get("group_by", [])
+            if cursor["group_by"] != group_by:
+                raise serializers.ValidationError({"cursor": ["Invalid cursor."]})
+            try:
+                cursor["values"] = [
+                    self.parse_value(name, value) if value is not None else None
+                    for name, value in zip(group_by, cursor["values"])
+                ]
+            except serializers.ValidationError:
+                raise serializers.ValidationError({"cursor": ["Invalid cursor."]})
+        return attrs
+
+    def validate_group_by(self, value):
+        names = list(dict.fromkeys(self.split_names(value)))
+        errors = []
+        for name in names:
+            if name not in self.column_types:
+                errors.append(f"Field '{name}' not found in model.")
+            elif self.column_types[name] not in (FieldType.STRING, FieldType.BOOLEAN):
+                errors.append(f"Field '{name}' is not a STR or BOOL field.")
+        if errors:
+            raise serializers.ValidationError(errors)
+        return names
+
+    def validate_metrics(self, value):
+        metrics, errors = [], []
+        for metric in dict.fromkeys(self.split_names(value)):
+            column, _, function = metric.rpartition("__")
+            if metric == "count":
+                metrics.append((metric, None, "count"))
+            elif function not in AGGREGATE_FUNCTIONS:
+                errors.append(f"Metric '{metric}' is not 'count' or '<field>__<function>', "
+                              f"with one of the functions {', '.join(AGGREGATE_FUNCTIONS)}.")
+            elif column not in self.column_types:
+                errors.append(f"Field '{column}' not found in model.")
+            elif self.column_types[column] != FieldType.NUMBER:
+                errors.append(f"Field '{column}' is not a NUM field.")
+            else:
+                metrics.append((metric, column, function))
+        if not metrics and not errors:
+            errors.append("At least one metric is required.")
+        # annotations can't shadow the model's fields
+        errors += [f"Metric '{name}' conflicts with a field of the model." for name, _, _ in metrics if name in self.column_types]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return metrics
+
+
+class DynamicModelUpdateQuerySerializer(DynamicModelJobQuerySerializer):
+    """
+    Query parameters of the update view.
+    """
+    online = serializers.BooleanField(required=False, default=False)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ["id", "kind", "status", "result", "created_at", "started_at", "finished_at"]
+
+
+class JobAcceptedSerializer(serializers.Serializer):
+    """
+    Response of a view whose operation was queued as a job.
+    """
+    job_id = serializers.UUIDField()
+    status = serializers.CharField()
@@ -1,14 +1,46 @@
+from asgiref.sync import sync_to_async
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.urls import reverse
-from api.models import DynamicModelTable, FieldType
+from django.conf import settings
+from django.db import connection, connections, DatabaseError, IntegrityError
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from api.models import App, DynamicModelTable, Field, FieldType, Job, JobStatus, RowCountMode
 from api.serializers import DynamicModelSerializer
+from api.registry import DynamicModelRegistry, model_registry
+from api.schema import SCHEMA_CHANGE_LOCK, OnlineSchemaChange, get_cast_rule
+from api.jobs import JOB_HANDLERS, claim_job, enqueue_job, process_jobs, run_job
+from api.rows import ingest_rows
+from api.backends.postgresql.base import connection_stats
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+import json
 import random
+import threading
 from uuid import uuid4
 
 
 class DynamicModelTestMixin:
     """ Dynamic model test helper functions. """
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """
+        Check that the block runs at most `budget` queries, not counting savepoints.
+        """
+        with CaptureQueriesContext(connection) as context:
+            yield
+        queries = [
+            q["sql"] for q in context.captured_queries
+            if not q["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT"))
+        ]
+        self.assertLessEqual(len(queries), budget, "\n".join(queries))
+
     def create_table(self, data=None):
         """
         Create a new table.
@@ -64,6 +96,15 @@ class CreateTableTestCase(DynamicModelTestMixin, APITestCase):
         self.assertEqual(fields[1].name, "name")
         self.assertEqual(fields[1].field_type, FieldType.STRING)
 
+    def test_create_table_model_id_unique(self):
+        """
+        Test that a model id can't be registered twice, even under another app.
+        """
+        model_id = self.create_table()
+        other_app = App.objects.create(name="other", module="other")
+        with self.assertRaises(IntegrityError):
+            DynamicModelTable.objects.create(app=other_app, model_id=model_id)
+
     def test_create_table_error(self):
         """
         Test create_table POST view with invalid data (incorrect field type).
@@ -79,6 +120,53 @@ class CreateTableTestCase(DynamicModelTestMixin, APITestCase):
         self.assertTrue(status.is_client_error(response.status_code))
 
 
+class CreateTablesTestCase(DynamicModelTestMixin, APITestCase):
+    tables = [
+        {"fields": {"name": "STR", "age": "NUM"}, "natural_key": ["name"]},
+        {"fields": {"city": "STR", "insured": "BOOL"}, "indexes": [{"fields": ["city"], "condition": {"insured": True}}]},
+        {"fields": {"score": "NUM"}},
+    ]
+
+    def test_create_tables_ok(self):
+        url = reverse('api:create_tables')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {"tables": self.tables}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        model_ids = response.data["model_ids"]
+        self.assertEqual(len(model_ids), 3)
+
+        # a single statement per table, without per column ALTERs
+        statements = [q["sql"] for q in context.captured_queries]
+        self.assertEqual(len([sql for sql in statements if sql.startswith("CREATE TABLE")]), 3)
+        self.assertFalse([sql for sql in statements if sql.startswith("ALTER TABLE")])
+
+        for model_id, table in zip(model_ids, self.tables):
+            model_table = DynamicModelTable.objects.get(model_id=model_id)
+            fields = dict(model_table.fields.values_list("name", "field_type"))
+            self.assertEqual(fields, table["fields"])
+            self.assertEqual(model_table.natural_key, table.get("natural_key", []))
+            self.assertEqual(model_table.indexes.count(), len(table.get("indexes", [])) + bool(table.get("natural_key")))
+        self.add_table_row(model_ids[0], data={"fields": {"name": "Adam", "age": 23}})
+        self.add_table_row(model_ids[1], data={"fields": {"city": "Oslo", "insured": True}})
+        self.assertEqual(self.get_table_rows(model_ids[1]), [{"city": "Oslo", "insured": True}])
+        upsert_url = reverse('api:add_table_row', kwargs={"id": model_ids[0]}) + "?upsert=true"
+        response = self.client.post(upsert_url, {"fields": {"name": "Adam", "age": 24}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_table_rows(model_ids[0]), [{"name": "Adam", "age": 24}])
+
+    def test_create_tables_error(self):
+        url = reverse('api:create_tables')
+        tables = [*self.tables, {"fields": {"date": "DATE"}}]
+        response = self.client.post(url, {"tables": tables}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(DynamicModelTable.objects.count(), 0)
+        with override_settings(DYNAMIC_MODEL_BATCH_MAX_TABLES=2):
+            response = self.client.post(url, {"tables": self.tables}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {"tables": []}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class EditTableTestCase(DynamicModelTestMixin, APITestCase):
     def test_edit_table_ok(self):
         """
@@ -143,6 +231,193 @@ class EditTableTestCase(DynamicModelTestMixin, APITestCase):
         self.assertIn({'name': None, "age": row_2["fields"]["age"]}, row_data)
 
     
+    def test_edit_table_single_alter(self):
+        """
+        Test that all column changes are applied with one ALTER TABLE statement.
+        """
+        new_model_id = self.create_table()
+        data = {
+            "fields": {
+                "name": "NUM", # changed field type
+                "age": "STR", # changed field type
+                "insured": "BOOL", # new field
+                "height": "NUM", # new field
+            }
+        }
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, data, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+        alter_statements = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("ALTER TABLE")]
+        self.assertEqual(len(alter_statements), 1)
+
+        updated_model = DynamicModelTable.objects.get(model_id=new_model_id)
+        self.assertEqual(
+            dict(updated_model.fields.values_list("name", "field_type")),
+            {"name": "NUM", "age": "STR", "insured": "BOOL", "height": "NUM"},
+        )
+        self.add_table_row(new_model_id, data={"fields": {"name": 1, "age": "old", "insured": True, "height": 180}})
+
+    def test_edit_table_converts_values(self):
+        """
+        Test that retyped columns keep the values which fit the new type.
+        """
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "STR", "insured": "NUM"}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": " 23 ", "insured": 1}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Mike", "age": "old", "insured": 5}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Eve", "age": None, "insured": 0}})
+
+        data = {
+            "fields": {
+                "age": "NUM", # changed field type
+                "insured": "BOOL", # changed field type
+            }
+        }
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        response = self.client.put(url, data, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertEqual(response.data["nulled_values"], {"age": 1, "insured": 1})
+
+        row_data = self.get_table_rows(new_model_id)
+        self.assertEqual(row_data, [
+            {"name": "Adam", "age": 23, "insured": True},
+            {"name": "Mike", "age": None, "insured": None},
+            {"name": "Eve", "age": None, "insured": False},
+        ])
+
+    @override_settings(DYNAMIC_MODEL_CAST_RULES={("NUM", "BOOL"): "{column} <> 0"})
+    def test_edit_table_custom_cast_rule(self):
+        """
+        Test that cast rules can be overridden in the settings.
+        """
+        new_model_id = self.create_table(data={"fields": {"insured": "NUM"}})
+        self.add_table_row(new_model_id, data={"fields": {"insured": 5}})
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        response = self.client.put(url, {"fields": {"insured": "BOOL"}}, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertNotIn("nulled_values", response.data)
+        self.assertEqual(self.get_table_rows(new_model_id), [{"insured": True}])
+
+    @override_settings(DYNAMIC_MODEL_ONLINE_BACKFILL_BATCH_SIZE=2)
+    def test_edit_table_online(self):
+        """
+        Test that an online update converts values in batches and cleans up after itself.
+        """
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "STR"}})
+        for age in ["23", "old", "41", None, "7"]:
+            self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": age}})
+
+        url = reverse('api:edit_table', kwargs={"id": new_model_id}) + "?online=true"
+        response = self.client.put(url, {"fields": {"age": "NUM", "insured": "BOOL"}}, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertEqual(response.data["nulled_values"], {"age": 1})
+
+        self.add_table_row(new_model_id, data={"fields": {"name": "Eve", "age": 30, "insured": True}})
+        self.assertEqual([(row["age"], row["insured"]) for row in self.get_table_rows(new_model_id)], [
+            (23, None), (None, None), (41, None), (None, None), (7, None), (30, True),
+        ])
+
+        columns, triggers = self.get_columns_and_triggers(new_model_id)
+        self.assertEqual(sorted(columns), ["age", "id", "insured", "name"])
+        self.assertEqual(triggers, 0)
+
+    def get_columns_and_triggers(self, model_id):
+        db_table = DynamicModelTable.objects.get(model_id=model_id).get_django_model()._meta.db_table
+        with connection.cursor() as cursor:
+            columns = [c.name for c in connection.introspection.get_table_description(cursor, db_table)]
+            cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal", [db_table])
+            triggers = cursor.fetchone()[0]
+        return columns, triggers
+
+    def interrupt_online_change(self, model_id):
+        """
+        Leave a conversion of 'age' to NUM behind, as if its worker died before it finished.
+        """
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        schema_change = OnlineSchemaChange(model_table.get_django_model())
+        field = Field(name="age", field_type=FieldType.NUMBER).get_django_field()
+        field.set_attributes_from_name("age")
+        with connection.schema_editor() as schema_editor:
+            schema_change.start_conversion(
+                schema_editor, [field], {"age": get_cast_rule(FieldType.STRING, FieldType.NUMBER)}
+            )
+
+    def test_edit_table_online_removes_leftovers(self):
+        """
+        Test that an online update cleans up after an earlier one which was interrupted.
+        """
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "STR"}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": "23"}})
+        self.interrupt_online_change(new_model_id)
+
+        url = reverse('api:edit_table', kwargs={"id": new_model_id}) + "?online=true"
+        response = self.client.put(url, {"fields": {"age": "NUM"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_table_rows(new_model_id), [{"name": "Adam", "age": 23}])
+        columns, triggers = self.get_columns_and_triggers(new_model_id)
+        self.assertEqual(sorted(columns), ["age", "id", "name"])
+        self.assertEqual(triggers, 0)
+
+    def test_edit_table_removes_online_leftovers(self):
+        """
+        Test that an offline update cleans up after an interrupted online one as well.
+        """
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "STR"}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": "23"}})
+        self.interrupt_online_change(new_model_id)
+
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        response = self.client.put(url, {"fields": {"age": "NUM"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        columns, triggers = self.get_columns_and_triggers(new_model_id)
+        self.assertEqual(sorted(columns), ["age", "id", "name"])
+        self.assertEqual(triggers, 0)
+
+        # writes no longer go through the old conversion's trigger
+        self.add_table_row(new_model_id, data={"fields": {"name": "Eve", "age": 45}})
+        url = reverse('api:get_table_rows', kwargs={"id": new_model_id}) + "?name=Adam"
+        response = self.client.patch(url, {"fields": {"age": 24}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(
+            self.get_table_rows(new_model_id),
+            [{"name": "Adam", "age": 24}, {"name": "Eve", "age": 45}],
+        )
+
+    def test_edit_table_during_schema_change(self):
+        """
+        Test that updates are turned away while another one changes the table's schema.
+        """
+        new_model_id = self.create_table()
+        table_id = DynamicModelTable.objects.get(model_id=new_model_id).pk
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        other = connections.create_connection("default")
+        try:
+            # an online change running on another connection
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s, %s)", [SCHEMA_CHANGE_LOCK, table_id])
+            for online in ["false", "true"]:
+                response = self.client.put(f"{url}?online={online}", {"fields": {"age": "STR"}}, format="json")
+                self.assertEqual(response.status_code, status.HTTP_409_CONFLICT, online)
+                self.assertIn("in progress", response.data["error"])
+        finally:
+            # a pooled connection outlives close(), and its session locks with it
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [SCHEMA_CHANGE_LOCK, table_id])
+            other.close()
+        response = self.client.put(f"{url}?online=true", {"fields": {"age": "STR"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_edit_table_unchanged(self):
+        """
+        Test that resubmitting the current fields leaves the schema version alone.
+        """
+        new_model_id = self.create_table()
+        schema_version = DynamicModelTable.objects.get(model_id=new_model_id).schema_version
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        response = self.client.put(url, {"fields": {"name": "STR"}}, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+        self.assertEqual(DynamicModelTable.objects.get(model_id=new_model_id).schema_version, schema_version)
+
     def test_edit_table_incorrect_model_id(self):
         """
         Test edit_table POST view with invalid model id.
@@ -162,6 +437,99 @@ class EditTableTestCase(DynamicModelTestMixin, APITestCase):
         self.assertTrue(status.is_client_error(response.status_code))
 
 
+class TableIndexTestCase(DynamicModelTestMixin, APITestCase):
+    def get_index_definitions(self, model_id):
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        db_table = model_table.get_django_model()._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [db_table])
+            return dict(cursor.fetchall())
+
+    def test_create_table_with_indexes(self):
+        new_model_id = self.create_table(data={
+            "fields": {"name": "STR", "age": "NUM", "insured": "BOOL"},
+            "indexes": [
+                {"fields": ["age"]},
+                {"fields": ["name", "age"], "unique": True},
+                {"fields": ["age"], "condition": {"insured": True}},
+            ],
+        })
+        model_table = DynamicModelTable.objects.get(model_id=new_model_id)
+        django_model = model_table.get_django_model()
+        self.assertEqual(len(django_model._meta.indexes), 2)
+        self.assertEqual(len(django_model._meta.constraints), 1)
+
+        definitions = self.get_index_definitions(new_model_id)
+        for table_index in model_table.indexes.all():
+            self.assertIn(table_index.name, definitions)
+        self.assertTrue(any(d.startswith("CREATE UNIQUE INDEX") and "(name, age)" in d for d in definitions.values()))
+        # built along with the table, by Django's schema editor
+        self.assertTrue(any(d.endswith("(age) WHERE insured") for d in definitions.values()))
+
+    def test_edit_table_adds_indexes(self):
+        new_model_id = self.create_table()
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": 23}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": 31}})
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        data = {
+            "fields": {"insured": "BOOL"},
+            "indexes": [
+                {"fields": ["age"], "condition": {"insured": False}},
+                {"fields": ["name"], "unique": True},
+            ],
+        }
+        response = self.client.put(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the names aren't unique, so that index is dropped again
+        self.assertEqual([error["fields"] for error in response.data["index_errors"]], [["name"]])
+        model_table = DynamicModelTable.objects.get(model_id=new_model_id)
+        self.assertEqual([table_index.fields for table_index in model_table.indexes.all()], [["age"]])
+        self.assertEqual(len(self.get_index_definitions(new_model_id)), 2)
+
+        # declaring it again is a no-op
+        response = self.client.put(url, {"fields": {}, "indexes": data["indexes"][:1]}, format="json")
+        self.assertEqual(response.data, {"model_id": model_table.model_id})
+
+    def test_indexes_error(self):
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "insured": "BOOL"}, "indexes": [
+            {"fields": ["name"], "condition": {"insured": True}},
+        ]})
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        for indexes in [[{"fields": ["height"]}], [{"fields": ["name"], "condition": {"name": True}}], [{"fields": []}]]:
+            response = self.client.put(url, {"fields": {}, "indexes": indexes}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, indexes)
+        # partial indexes filter on the field, so its type is kept
+        response = self.client.put(url, {"fields": {"insured": "NUM"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unique_index_field_not_retyped(self):
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "NUM"}, "indexes": [
+            {"fields": ["age", "name"], "unique": True},
+        ]})
+        self.add_table_row(new_model_id, data={"fields": {"name": "yes", "age": 23}})
+        self.add_table_row(new_model_id, data={"fields": {"name": "true", "age": 23}})
+        index_name = DynamicModelTable.objects.get(model_id=new_model_id).indexes.get().name
+        url = reverse('api:edit_table', kwargs={"id": new_model_id})
+        for online in ["false", "true"]:
+            # both names would convert to true, breaking the unique index
+            response = self.client.put(f"{url}?online={online}", {"fields": {"name": "BOOL"}}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, online)
+            self.assertEqual(
+                response.data["fields"], [f"Field 'name' is covered by the unique index '{index_name}'."]
+            )
+
+    def test_online_edit_table_rebuilds_indexes(self):
+        new_model_id = self.create_table(data={"fields": {"name": "STR", "age": "STR"}, "indexes": [
+            {"fields": ["age"]},
+        ]})
+        self.add_table_row(new_model_id, data={"fields": {"name": "Adam", "age": "23"}})
+        url = reverse('api:edit_table', kwargs={"id": new_model_id}) + "?online=true"
+        response = self.client.put(url, {"fields": {"age": "NUM"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        model_table = DynamicModelTable.objects.get(model_id=new_model_id)
+        self.assertIn(model_table.indexes.get().name, self.get_index_definitions(new_model_id))
+
+
 class AddTableRowTestCase(DynamicModelTestMixin, APITestCase):
     def test_add_table_row_ok(self):
         """
@@ -247,6 +615,60 @@ class AddTableRowTestCase(DynamicModelTestMixin, APITestCase):
         self.assertTrue(status.is_client_error(response.status_code))
         self.assertIn("value must be either True, False, or None.", response.data["error"][0])
 
+    def test_add_table_row_error_uncoerced_values(self):
+        """
+        Test that values of the wrong JSON type are rejected rather than coerced.
+        """
+        model_id = self.create_table(data={"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}})
+        url = reverse('api:add_table_row', kwargs={"id": model_id})
+        for name, value, error in [
+            ("name", {"a": 1}, "Expected a string."),
+            ("name", 23, "Expected a string."),
+            ("age", 12.7, "Expected an integer."),
+            ("age", True, "Expected an integer."),
+            ("age", [1], "Expected an integer."),
+            ("insured", {"a": 1}, "Expected a boolean."),
+            ("insured", [], "Expected a boolean."),
+        ]:
+            response = self.client.post(url, {"fields": {name: value}}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (name, value))
+            self.assertEqual(response.data["error"], [error])
+        django_model = DynamicModelTable.objects.get(model_id=model_id).get_django_model()
+        self.assertEqual(django_model.objects.count(), 0)
+
+        # whole numbers and numeric strings are still taken
+        for age in [12.0, "12"]:
+            response = self.client.post(url, {"fields": {"age": age}}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, age)
+        self.assertEqual(list(django_model.objects.values_list("age", flat=True)), [12, 12])
+
+    def test_add_table_row_error_wrong_data_types(self):
+        """
+        Test that every incorrect value of a row is reported at once.
+        """
+        table_data = {
+            "fields": {
+                "name": "STR",
+                "age": "NUM",
+                "insured": "BOOL"
+            }
+        }
+        model_id = self.create_table(data=table_data)
+
+        data = {
+            "fields": {
+                "name": "A" * 151, # error
+                "age": "twenty", # error
+                "insured": "Foo" # error
+            }
+        }
+        url = reverse('api:add_table_row', kwargs={"id": model_id})
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data["error"]), 3)
+        django_model = DynamicModelTable.objects.get(model_id=model_id).get_django_model()
+        self.assertEqual(django_model.objects.count(), 0)
+
 
 class GetTableRowsTestCase(DynamicModelTestMixin, APITestCase):
     def test_get_table_rows_ok(self):
@@ -273,3 +695,1049 @@ class GetTableRowsTestCase(DynamicModelTestMixin, APITestCase):
         url = reverse('api:get_table_rows', kwargs={"id": model_id})
         response = self.client.get(url, format="json")
         self.assertTrue(status.is_client_error(response.status_code))
+
+    def test_get_table_rows_paginated(self):
+        """
+        Test walking a table page by page through the next page links.
+        """
+        model_id = self.create_table()
+        rows = [self.add_table_row(model_id)["fields"] for _ in range(5)]
+
+        url = reverse('api:get_table_rows', kwargs={"id": model_id}) + "?limit=2"
+        pages = []
+        while url:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            url = response.get("Link", "").partition(">")[0].lstrip("<")
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([row for page in pages for row in page], rows)
+
+    def test_get_table_rows_streamed(self):
+        """
+        Test streaming all table rows as newline delimited JSON.
+        """
+        model_id = self.create_table()
+        rows = [self.add_table_row(model_id)["fields"] for _ in range(3)]
+
+        url = reverse('api:get_table_rows', kwargs={"id": model_id}) + "?stream=true&limit=1"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], rows)
+
+    def test_get_table_rows_error_invalid_params(self):
+        """
+        Test that malformed cursors and oversized pages are rejected.
+        """
+        model_id = self.create_table()
+        url = reverse('api:get_table_rows', kwargs={"id": model_id})
+        response = self.client.get(url + "?cursor=foo", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url + "?limit=1000000", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table()
+        self.add_table_row(self.model_id)
+        self.url = reverse('api:get_table_rows', kwargs={"id": self.model_id})
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, format="json")
+        etag = response["ETag"]
+        with self.assertQueryBudget(1):
+            response = self.client.get(self.url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.url, format="json", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_modified_by_writes(self):
+        etags = [self.client.get(self.url, format="json")["ETag"]]
+        self.add_table_row(self.model_id)
+        etags.append(self.client.get(self.url, format="json")["ETag"])
+        bulk_url = reverse('api:bulk_add_table_rows', kwargs={"id": self.model_id})
+        self.client.post(bulk_url, [{"name": "Adam", "age": 23}], format="json")
+        etags.append(self.client.get(self.url, format="json")["ETag"])
+        edit_url = reverse('api:edit_table', kwargs={"id": self.model_id})
+        self.client.put(edit_url, {"fields": {"insured": "BOOL"}}, format="json")
+        etags.append(self.client.get(self.url, format="json")["ETag"])
+        self.assertEqual(len(set(etags)), 4)
+
+        response = self.client.get(self.url, format="json", HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+    async def test_async_not_modified(self):
+        url = reverse('api:async_get_table_rows', kwargs={"id": self.model_id})
+        response = await self.async_client.get(url)
+        response = await self.async_client.get(url, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class QueryTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table(data={"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}})
+        self.rows = [
+            {"name": "Adam", "age": 23, "insured": True},
+            {"name": "Mike", "age": 31, "insured": False},
+            {"name": "Eve", "age": None, "insured": None},
+            {"name": "Adele", "age": 31, "insured": True},
+        ]
+        for row in self.rows:
+            self.add_table_row(self.model_id, data={"fields": row})
+        self.url = reverse('api:get_table_rows', kwargs={"id": self.model_id})
+
+    def get_rows(self, query):
+        response = self.client.get(self.url + "?" + query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def test_filter_rows(self):
+        self.assertEqual(self.get_rows("age=31"), [self.rows[1], self.rows[3]])
+        self.assertEqual(self.get_rows("age__gt=25&insured=true"), [self.rows[3]])
+        self.assertEqual(self.get_rows("age__in=23,31&name__contains=Ad"), [self.rows[0], self.rows[3]])
+        self.assertEqual(self.get_rows("age__isnull=true"), [self.rows[2]])
+
+    def test_project_rows(self):
+        self.assertEqual(self.get_rows("fields=name&age__lt=30"), [{"name": "Adam"}])
+        ids = [row["id"] for row in self.get_rows("fields=id,name")]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_order_rows(self):
+        self.assertEqual(self.get_rows("ordering=-age,name"), [
+            self.rows[3], self.rows[1], self.rows[0], self.rows[2],
+        ])
+
+    def test_order_rows_paginated(self):
+        """
+        Test that the cursor carries the ordering columns, NULLs included.
+        """
+        for ordering in ["-age,name", "age", "insured,-name", "-insured"]:
+            expected = self.get_rows(f"fields=name&ordering={ordering}")
+            url = self.url + f"?fields=name&ordering={ordering}&limit=1"
+            pages = []
+            while url:
+                response = self.client.get(url, format="json")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                pages.extend(response.data)
+                url = response.get("Link", "").partition(">")[0].lstrip("<")
+            self.assertEqual(pages, expected, ordering)
+
+    def test_query_rows_single_query(self):
+        self.get_rows("age=31")
+        with self.assertQueryBudget(2):
+            self.get_rows("fields=name&age__gt=25&ordering=-age&limit=1")
+
+    def test_query_rows_errors(self):
+        for query in ["height=3", "age=old", "insured__contains=t", "fields=height", "ordering=height", "age__isnull=maybe"]:
+            response = self.client.get(self.url + "?" + query, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        # a cursor is only valid with the ordering it was made for
+        next_url = self.client.get(self.url + "?ordering=age&limit=1", format="json")["Link"].partition(">")[0].lstrip("<")
+        response = self.client.get(next_url.replace("ordering=age", "ordering=name"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(next_url.replace("&ordering=age", ""), format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EditTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table(data={"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}})
+        for row in [
+            {"name": "Adam", "age": 23, "insured": False},
+            {"name": "Mike", "age": 31, "insured": False},
+            {"name": "Eve", "age": 45, "insured": None},
+        ]:
+            self.add_table_row(self.model_id, data={"fields": row})
+        self.url = reverse('api:get_table_rows', kwargs={"id": self.model_id})
+
+    def get_model_table(self):
+        return DynamicModelTable.objects.get(model_id=self.model_id)
+
+    def test_update_rows(self):
+        data_version = self.get_model_table().data_version
+        with self.assertQueryBudget(3):
+            response = self.client.patch(self.url + "?age__gt=30", {"fields": {"insured": True}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data, {"updated": 2})
+        rows = self.get_table_rows(self.model_id)
+        self.assertEqual([row["insured"] for row in rows], [False, True, True])
+        self.assertEqual(self.get_model_table().data_version, data_version + 1)
+
+        response = self.client.patch(self.url + "?name=Nobody", {"fields": {"age": 1}}, format="json")
+        self.assertEqual(response.data, {"updated": 0})
+        self.assertEqual(self.get_model_table().data_version, data_version + 1)
+
+    def test_update_single_row(self):
+        row_id = self.client.get(self.url + "?name=Mike&fields=id", format="json").data[0]["id"]
+        url = reverse('api:edit_table_row', kwargs={"id": self.model_id, "row_id": row_id})
+        with self.assertQueryBudget(3):
+            response = self.client.patch(url, {"fields": {"age": 32, "name": None}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(self.get_table_rows(self.model_id)[1], {"name": None, "age": 32, "insured": False})
+
+        url = reverse('api:edit_table_row', kwargs={"id": self.model_id, "row_id": row_id + 100})
+        response = self.client.patch(url, {"fields": {"age": 32}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_rows(self):
+        with self.assertQueryBudget(3):
+            response = self.client.delete(self.url + "?insured=false&age__lt=30", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data, {"deleted": 1})
+        self.assertEqual([row["name"] for row in self.get_table_rows(self.model_id)], ["Mike", "Eve"])
+        self.assertEqual(self.get_model_table().row_count, 2)
+
+        response = self.client.delete(self.url + "?all=true", format="json")
+        self.assertEqual(response.data, {"deleted": 2})
+        self.assertEqual(self.get_model_table().row_count, 0)
+
+    def test_edit_all_rows(self):
+        # without filters, every row is only changed when asked for
+        for query in ["", "all=false"]:
+            response = self.client.patch(self.url + "?" + query, {"fields": {"age": 1}}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+            response = self.client.delete(self.url + "?" + query, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        self.assertEqual([row["age"] for row in self.get_table_rows(self.model_id)], [23, 31, 45])
+
+        response = self.client.patch(self.url + "?all=true", {"fields": {"age": 1}}, format="json")
+        self.assertEqual(response.data, {"updated": 3})
+        response = self.client.delete(self.url + "?all=true&name=Eve", format="json")
+        self.assertEqual(response.data, {"deleted": 1})
+
+    def test_edit_rows_errors(self):
+        for query, data in [
+            ("height=3", {"fields": {"age": 1}}),
+            ("age=old", {"fields": {"age": 1}}),
+            ("all=true", {"fields": {"height": 1}}),
+            ("all=true", {"fields": {"age": "old"}}),
+            ("all=true", {"fields": {}}),
+        ]:
+            response = self.client.patch(self.url + "?" + query, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.delete(self.url + "?insured__contains=t", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.get_table_rows(self.model_id)), 3)
+
+
+class CountTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table()
+        for age in [31, 45]:
+            self.add_table_row(self.model_id, data={"fields": {"name": "Mike", "age": age}})
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": self.model_id})
+        self.client.post(url, [{"name": "Adam", "age": 23}, {"name": "Mike", "age": "old"}], format="json")
+        self.url = reverse('api:count_table_rows', kwargs={"id": self.model_id})
+
+    def count(self, query):
+        response = self.client.get(self.url + "?" + query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data["count"]
+
+    def test_count_table_rows(self):
+        self.assertEqual(self.count("mode=cached"), 3)
+        self.assertEqual(self.count("mode=exact"), 3)
+        self.assertEqual(self.count("age=23"), 1)
+        # never analyzed, so the estimate falls back to an exact count
+        self.assertEqual(self.count("mode=estimate"), 3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE "api_{}"'.format(self.model_id))
+        self.assertEqual(self.count("mode=estimate"), 3)
+
+    def test_unknown_cached_count(self):
+        DynamicModelTable.objects.filter(model_id=self.model_id).update(row_count=None)
+        self.assertEqual(self.count("mode=cached"), 3)
+        self.assertEqual(DynamicModelTable.objects.get(model_id=self.model_id).row_count, 3)
+
+    def test_exact_count_read_only(self):
+        DynamicModelTable.objects.filter(model_id=self.model_id).update(row_count=None)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.count("mode=exact"), 3)
+        # exact counts neither lock nor write the table's row
+        for query in context.captured_queries:
+            self.assertNotIn("UPDATE", query["sql"])
+        self.assertIsNone(DynamicModelTable.objects.get(model_id=self.model_id).row_count)
+
+    def test_unknown_cached_count_changed(self):
+        DynamicModelTable.objects.filter(model_id=self.model_id).update(row_count=None)
+        model_table = DynamicModelTable.objects.get(model_id=self.model_id)
+        # a row added after the table was loaded is counted, but the count isn't
+        # kept, since it can't tell whether a change was committed in between
+        self.add_table_row(self.model_id, data={"fields": {"name": "Eve", "age": 27}})
+        self.assertEqual(model_table.get_row_count(RowCountMode.CACHED), 4)
+        self.assertIsNone(DynamicModelTable.objects.get(model_id=self.model_id).row_count)
+        self.assertEqual(self.count("mode=cached"), 4)
+        self.assertEqual(DynamicModelTable.objects.get(model_id=self.model_id).row_count, 4)
+
+    def test_cached_count_without_model(self):
+        model_table = DynamicModelTable.objects.get(model_id=self.model_id)
+        with mock.patch.object(DynamicModelTable, "get_django_model") as get_django_model:
+            self.assertEqual(model_table.get_row_count(RowCountMode.CACHED), 3)
+        get_django_model.assert_not_called()
+
+    def test_count_table_rows_error(self):
+        response = self.client.get(self.url + "?mode=estimate&age=23", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_table_rows_count_header(self):
+        url = reverse('api:get_table_rows', kwargs={"id": self.model_id})
+        response = self.client.get(url + "?limit=1", format="json")
+        self.assertEqual(response["X-Total-Count"], "3")
+        self.assertEqual(response["X-Total-Count-Mode"], "cached")
+        response = self.client.get(url + "?age=23", format="json")
+        self.assertFalse(response.has_header("X-Total-Count"))
+        with override_settings(DYNAMIC_MODEL_ROW_COUNT_MODE="exact"):
+            response = self.client.get(url + "?age=23", format="json")
+        self.assertEqual(response["X-Total-Count"], "1")
+
+
+class AggregateTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table(data={"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}})
+        for row in [
+            {"name": "Adam", "age": 20, "insured": True},
+            {"name": "Mike", "age": 30, "insured": False},
+            {"name": "Eve", "age": None, "insured": True},
+            {"name": "Adam", "age": 40, "insured": True},
+        ]:
+            self.add_table_row(self.model_id, data={"fields": row})
+        self.url = reverse('api:aggregate_table_rows', kwargs={"id": self.model_id})
+
+    def aggregate(self, query):
+        response = self.client.get(self.url + "?" + query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def test_aggregate_table_rows(self):
+        self.assertEqual(self.aggregate("metrics=count,age__count,age__sum,age__min,age__max"), [
+            {"count": 4, "age__count": 3, "age__sum": 90, "age__min": 20, "age__max": 40},
+        ])
+
+    def test_aggregate_table_rows_grouped(self):
+        self.assertEqual(self.aggregate("group_by=insured&metrics=count,age__avg"), [
+            {"insured": False, "count": 1, "age__avg": 30.0},
+            {"insured": True, "count": 3, "age__avg": 30.0},
+        ])
+        self.assertEqual(self.aggregate("group_by=name,insured&metrics=age__sum&age__gt=25"), [
+            {"name": "Adam", "insured": True, "age__sum": 40},
+            {"name": "Mike", "insured": False, "age__sum": 30},
+        ])
+
+    def test_aggregate_table_rows_paginated(self):
+        self.add_table_row(self.model_id, data={"fields": {"name": None, "age": 50, "insured": True}})
+        query = "group_by=name,insured&metrics=count"
+        groups = self.aggregate(query)
+        self.assertEqual(len(groups), 4)
+        self.assertIsNone(groups[-1]["name"])
+
+        # every group is on exactly one page, the last page has no Link header
+        pages, url = [], f"{self.url}?{query}&limit=1"
+        while url:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+            pages.append(response.data)
+            url = response.get("Link", "").partition(">")[0].lstrip("<")
+        self.assertEqual(pages, [[group] for group in groups])
+
+        # a cursor only works with the group_by it was made for
+        response = self.client.get(f"{self.url}?{query}&limit=1", format="json")
+        next_url = response["Link"].partition(">")[0].lstrip("<")
+        cursor = parse_qs(urlsplit(next_url).query)["cursor"][0]
+        for params in [
+            {"group_by": "name", "metrics": "count", "cursor": cursor},
+            {"metrics": "count", "cursor": cursor},
+            {"group_by": "name,insured", "metrics": "count", "cursor": "abc"},
+        ]:
+            response = self.client.get(self.url, params, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_aggregate_table_rows_single_query(self):
+        self.aggregate("metrics=count")
+        with self.assertQueryBudget(2):
+            self.aggregate("group_by=name&metrics=count,age__avg&insured=true")
+
+    def test_aggregate_table_rows_errors(self):
+        for query in ["", "metrics=name__sum", "metrics=age__median", "group_by=age&metrics=count", "metrics=count&height=1"]:
+            response = self.client.get(self.url + "?" + query, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.get(reverse('api:aggregate_table_rows', kwargs={"id": uuid4()}) + "?metrics=count")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncRowsTestCase(DynamicModelTestMixin, APITestCase):
+    async def test_async_add_table_row(self):
+        new_model_id = await sync_to_async(self.create_table)()
+        url = reverse('api:async_add_table_row', kwargs={"id": new_model_id})
+        response = await self.async_client.post(
+            url, {"fields": {"name": "Adam", "age": 23}}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = await self.async_client.post(
+            url, {"fields": {"name": "Adam", "height": 178}}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"fields": ["Field 'height' not found in model."]})
+
+        response = await self.async_client.get(reverse('api:async_get_table_rows', kwargs={"id": new_model_id}))
+        self.assertEqual(response.json(), [{"name": "Adam", "age": 23}])
+
+    async def test_async_add_table_row_rolled_back(self):
+        new_model_id = await sync_to_async(self.create_table)()
+        url = reverse('api:async_add_table_row', kwargs={"id": new_model_id})
+        with mock.patch.object(DynamicModelTable, "mark_data_changed", side_effect=DatabaseError("failed")):
+            response = await self.async_client.post(
+                url, {"fields": {"name": "Adam", "age": 23}}, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # the row isn't kept without being counted
+        response = await self.async_client.get(reverse('api:async_get_table_rows', kwargs={"id": new_model_id}))
+        self.assertEqual(response.json(), [])
+        self.assertEqual(response["X-Total-Count"], "0")
+
+    async def test_async_get_table_rows_paginated(self):
+        new_model_id = await sync_to_async(self.create_table)()
+        rows = [await sync_to_async(self.add_table_row)(new_model_id) for _ in range(3)]
+        url = reverse('api:async_get_table_rows', kwargs={"id": new_model_id})
+        response = await self.async_client.get(url, {"limit": 2})
+        self.assertEqual(response.json(), [row["fields"] for row in rows[:2]])
+        next_url = response["Link"].split(";")[0].strip("<>")
+        response = await self.async_client.get(next_url)
+        self.assertEqual(response.json(), [row["fields"] for row in rows[2:]])
+        self.assertFalse(response.has_header("Link"))
+
+    async def test_async_get_table_rows_streamed(self):
+        new_model_id = await sync_to_async(self.create_table)()
+        rows = [await sync_to_async(self.add_table_row)(new_model_id) for _ in range(3)]
+        url = reverse('api:async_get_table_rows', kwargs={"id": new_model_id})
+        response = await self.async_client.get(url, {"stream": "true"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [line async for line in response.streaming_content]
+        self.assertEqual([json.loads(line) for line in lines], [row["fields"] for row in rows])
+
+    async def test_async_table_not_found(self):
+        for model_id in [uuid4(), "abc"]:
+            response = await self.async_client.get(reverse('api:async_get_table_rows', kwargs={"id": model_id}))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DynamicModelRegistryTestCase(DynamicModelTestMixin, APITestCase):
+    def test_cached_model_reused(self):
+        """
+        Test that repeated lookups return the cached class without touching the DB.
+        """
+        model_id = self.create_table()
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        django_model = model_table.get_django_model()
+
+        with self.assertNumQueries(0):
+            self.assertIs(model_table.get_django_model(), django_model)
+
+    def test_cached_model_evicted_on_update(self):
+        """
+        Test that a schema change replaces the cached class.
+        """
+        model_id = self.create_table()
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        old_model = model_table.get_django_model()
+        old_version = model_table.schema_version
+
+        url = reverse('api:edit_table', kwargs={"id": model_id})
+        data = {"fields": {"name": "STR", "age": "NUM", "insured": "BOOL"}}
+        response = self.client.put(url, data, format="json")
+        self.assertTrue(status.is_success(response.status_code))
+
+        model_table.refresh_from_db()
+        self.assertEqual(model_table.schema_version, old_version + 1)
+        new_model = model_table.get_django_model()
+        self.assertIsNot(new_model, old_model)
+        self.assertIn("insured", [f.name for f in new_model._meta.get_fields()])
+
+    def test_lru_bound(self):
+        """
+        Test that the least recently used entry is evicted past maxsize.
+        """
+        registry = DynamicModelRegistry(maxsize=2)
+        model_ids = [self.create_table() for _ in range(3)]
+        models = [DynamicModelTable.objects.get(model_id=model_id).get_django_model() for model_id in model_ids]
+        for model_id, django_model in zip(model_ids[:2], models[:2]):
+            registry.set(model_id, 0, django_model)
+        # touch the first entry so the second one is the oldest
+        registry.get(model_ids[0], 0)
+        registry.set(model_ids[2], 0, models[2])
+
+        self.assertEqual(len(registry), 2)
+        self.assertIn(model_ids[0], registry)
+        self.assertNotIn(model_ids[1], registry)
+        self.assertIsNone(registry.get(model_ids[0], 1))
+
+    def test_stale_version_from_other_worker(self):
+        """
+        Test that a version bump made elsewhere invalidates this process' cached class.
+        """
+        model_id = self.create_table()
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        old_model = model_table.get_django_model()
+
+        # simulate another worker changing the schema
+        model_table.fields.create(name="insured", field_type=FieldType.BOOLEAN)
+        DynamicModelTable.objects.filter(pk=model_table.pk).update(schema_version=F("schema_version") + 1)
+
+        fresh_table = DynamicModelTable.objects.get(model_id=model_id)
+        new_model = fresh_table.get_django_model()
+        self.assertIsNot(new_model, old_model)
+        self.assertIn("insured", [f.name for f in new_model._meta.get_fields()])
+
+
+class MaterializedTableTestCase(DynamicModelTestMixin, APITestCase):
+    def assertNoDDL(self, queries):
+        ddl = [q["sql"] for q in queries if q["sql"].lstrip().upper().startswith(("CREATE", "ALTER", "DROP"))]
+        self.assertEqual(ddl, [])
+
+    def test_create_table_marks_materialized(self):
+        """
+        Test that a newly created table is flagged as existing in the DB.
+        """
+        model_id = self.create_table()
+        self.assertTrue(DynamicModelTable.objects.get(model_id=model_id).materialized)
+
+    def test_read_paths_issue_no_ddl(self):
+        """
+        Test that reads and inserts on an existing table issue no DDL, even with a cold cache.
+        """
+        model_id = self.create_table()
+        self.add_table_row(model_id)
+        model_registry.evict(model_id)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_table_rows(model_id)
+            self.add_table_row(model_id)
+        self.assertNoDDL(queries.captured_queries)
+
+    def test_missing_table_created_once(self):
+        """
+        Test that an unmaterialized table is created on first lookup, and only then.
+        """
+        model_id = self.create_table()
+        model_table = DynamicModelTable.objects.get(model_id=model_id)
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(model_table.get_django_model())
+        DynamicModelTable.objects.filter(pk=model_table.pk).update(materialized=False)
+        model_registry.evict(model_id)
+
+        model_table.refresh_from_db()
+        django_model = model_table.get_django_model()
+        self.assertIn(django_model._meta.db_table, connection.introspection.table_names())
+        self.assertTrue(DynamicModelTable.objects.get(model_id=model_id).materialized)
+
+
+class BulkAddTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    table_data = {
+        "fields": {
+            "name": "STR",
+            "age": "NUM",
+            "insured": "BOOL"
+        }
+    }
+
+    def bulk_add_rows(self, model_id, data, content_type="application/json", **params):
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": model_id})
+        if params:
+            url += "?" + "&".join(f"{key}={value}" for key, value in params.items())
+        if content_type == "application/json":
+            return self.client.post(url, data, format="json")
+        return self.client.post(url, data, content_type=content_type)
+
+    def get_rows(self, model_id):
+        django_model = DynamicModelTable.objects.get(model_id=model_id).get_django_model()
+        return list(django_model.objects.order_by("id").values("name", "age", "insured"))
+
+    def test_bulk_add_json_rows_ok(self):
+        """
+        Test bulk insertion of a JSON array, in batches smaller than the payload.
+        """
+        model_id = self.create_table(data=self.table_data)
+        rows = [{"name": f"row {i}", "age": i, "insured": i % 2 == 0} for i in range(5)]
+
+        response = self.bulk_add_rows(model_id, rows, batch_size=2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["inserted"], 5)
+        self.assertEqual(response.data["error_count"], 0)
+        self.assertEqual(self.get_rows(model_id), rows)
+
+    @override_settings(DYNAMIC_MODEL_BULK_USE_COPY=False)
+    def test_bulk_add_rows_without_copy(self):
+        """
+        Test bulk insertion through bulk_create.
+        """
+        model_id = self.create_table(data=self.table_data)
+        rows = [{"name": "Adam", "age": 23, "insured": None}, {"name": "", "age": None, "insured": True}]
+
+        response = self.bulk_add_rows(model_id, rows)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_rows(model_id), rows)
+
+    def test_bulk_add_ndjson_rows_ok(self):
+        """
+        Test bulk insertion of newline delimited JSON.
+        """
+        model_id = self.create_table(data=self.table_data)
+        data = '{"name": "Adam", "age": 23}\n\n{"name": "Mike", "insured": false}\n'
+
+        response = self.bulk_add_rows(model_id, data, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_rows(model_id), [
+            {"name": "Adam", "age": 23, "insured": None},
+            {"name": "Mike", "age": None, "insured": False},
+        ])
+
+    def test_bulk_add_ndjson_rows_parse_error(self):
+        """
+        Test that a malformed line after the first batch reports the rows written before it.
+        """
+        model_id = self.create_table(data=self.table_data)
+        data = '{"name": "Adam"}\n{"name": "Mike"}\n{"name": "Eve"}\n{"name": \n{"name": "Bob"}\n'
+
+        response = self.bulk_add_rows(model_id, data, content_type="application/x-ndjson", batch_size=2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["inserted"], 3)
+        self.assertEqual(response.data["error_count"], 1)
+        self.assertEqual(response.data["errors"][0]["row"], 4)
+        self.assertIn("line 4", response.data["errors"][0]["errors"]["non_field_errors"][0])
+        self.assertEqual([row["name"] for row in self.get_rows(model_id)], ["Adam", "Mike", "Eve"])
+        self.assertEqual(DynamicModelTable.objects.get(model_id=model_id).row_count, 3)
+
+    def test_bulk_add_csv_rows_ok(self):
+        """
+        Test bulk insertion of CSV, where values are converted to the column types.
+        """
+        model_id = self.create_table(data=self.table_data)
+        data = 'name,age,insured\n"Adam, Jr.",23,True\nMike,,0\n'
+
+        response = self.bulk_add_rows(model_id, data, content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_rows(model_id), [
+            {"name": "Adam, Jr.", "age": 23, "insured": True},
+            {"name": "Mike", "age": None, "insured": False},
+        ])
+
+    def test_bulk_add_rows_partial_errors(self):
+        """
+        Test that invalid rows are reported without aborting the load.
+        """
+        model_id = self.create_table(data=self.table_data)
+        rows = [
+            {"name": "Adam", "age": 23},
+            {"name": "Mike", "insured": "Foo"}, # error
+            {"height": 178}, # error
+            {"name": "Eve", "age": 31},
+        ]
+
+        response = self.bulk_add_rows(model_id, rows)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["inserted"], 2)
+        self.assertEqual(response.data["error_count"], 2)
+        self.assertEqual([error["row"] for error in response.data["errors"]], [2, 3])
+        self.assertIn("value must be either True, False, or None.", response.data["errors"][0]["errors"]["insured"][0])
+        self.assertEqual(response.data["errors"][1]["errors"]["height"], ["Field 'height' not found in model."])
+        self.assertEqual([row["name"] for row in self.get_rows(model_id)], ["Adam", "Eve"])
+
+    def test_bulk_add_rows_uncoerced_values(self):
+        """
+        Test that bulk loads reject values of the wrong JSON type rather than coercing them.
+        """
+        model_id = self.create_table(data=self.table_data)
+        rows = [
+            {"name": {"a": 1}}, # error
+            {"name": "Adam", "age": 12.7}, # error
+            {"name": "Mike", "age": True}, # error
+            {"name": "Eve", "insured": [True]}, # error
+            {"name": "Anna", "age": 31, "insured": True},
+        ]
+        response = self.bulk_add_rows(model_id, rows)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["inserted"], 1)
+        self.assertEqual(
+            [(error["row"], error["errors"]) for error in response.data["errors"]],
+            [
+                (1, {"name": ["Expected a string."]}),
+                (2, {"age": ["Expected an integer."]}),
+                (3, {"age": ["Expected an integer."]}),
+                (4, {"insured": ["Expected a boolean."]}),
+            ],
+        )
+
+    def test_bulk_add_rows_error_not_a_list(self):
+        """
+        Test that a payload which isn't a list of rows is rejected.
+        """
+        model_id = self.create_table(data=self.table_data)
+        response = self.bulk_add_rows(model_id, {"name": "Adam"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UpsertTableRowsTestCase(DynamicModelTestMixin, APITestCase):
+    def setUp(self):
+        self.model_id = self.create_table(data={
+            "fields": {"name": "STR", "age": "NUM", "insured": "BOOL"},
+            "natural_key": ["name"],
+        })
+        self.add_url = reverse('api:add_table_row', kwargs={"id": self.model_id}) + "?upsert=true"
+        self.bulk_url = reverse('api:bulk_add_table_rows', kwargs={"id": self.model_id}) + "?upsert=true"
+
+    def get_rows(self):
+        django_model = DynamicModelTable.objects.get(model_id=self.model_id).get_django_model()
+        return list(django_model.objects.order_by("name").values("name", "age", "insured"))
+
+    def test_upsert_row(self):
+        for age in [23, 24]:
+            response = self.client.post(self.add_url, {"fields": {"name": "Adam", "age": age}}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(self.get_rows(), [{"name": "Adam", "age": 24, "insured": None}])
+        # the cached count only grows with new rows
+        self.assertEqual(DynamicModelTable.objects.get(model_id=self.model_id).row_count, 1)
+
+        # plain inserts are held to the natural key as well
+        url = reverse('api:add_table_row', kwargs={"id": self.model_id})
+        response = self.client.post(url, {"fields": {"name": "Adam"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_upsert_rows(self):
+        self.client.post(self.bulk_url, [{"name": "Adam", "age": 23}, {"name": "Mike", "age": 31}], format="json")
+        rows = [
+            {"name": "Adam", "age": 24, "insured": True},
+            {"name": "Eve", "age": 45},
+            {"name": "Adam", "age": 25},
+            {"age": 50},
+        ]
+        with self.assertQueryBudget(3):
+            response = self.client.post(self.bulk_url, rows, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data["upserted"], 3)
+        self.assertEqual(response.data["errors"], [
+            {"row": 4, "errors": {"name": ["This field is required for upserts."]}},
+        ])
+        self.assertEqual(self.get_rows(), [
+            {"name": "Adam", "age": 25, "insured": None},
+            {"name": "Eve", "age": 45, "insured": None},
+            {"name": "Mike", "age": 31, "insured": None},
+        ])
+        self.assertEqual(DynamicModelTable.objects.get(model_id=self.model_id).row_count, 3)
+
+    def test_upsert_key_only_rows(self):
+        model_id = self.create_table(data={"fields": {"name": "STR"}, "natural_key": ["name"]})
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": model_id}) + "?upsert=true"
+        for rows in [[{"name": "Adam"}], [{"name": "Adam"}, {"name": "Eve"}]]:
+            response = self.client.post(url, rows, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(DynamicModelTable.objects.get(model_id=model_id).row_count, 2)
+
+    def test_upsert_errors(self):
+        response = self.client.post(self.add_url, {"fields": {"age": 23}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        model_id = self.create_table()
+        url = reverse('api:add_table_row', kwargs={"id": model_id}) + "?upsert=true"
+        response = self.client.post(url, {"fields": {"name": "Adam"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": model_id}) + "?upsert=true"
+        response = self.client.post(url, [{"name": "Adam"}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_natural_key_errors(self):
+        url = reverse('api:create_table')
+        for natural_key in [["height"], ["name", "name"], []]:
+            data = {"fields": {"name": "STR"}, "natural_key": natural_key}
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, natural_key)
+
+        url = reverse('api:edit_table', kwargs={"id": self.model_id})
+        for data in [{"fields": {"name": "NUM"}}, {"fields": {}, "natural_key": ["age"]}]:
+            response = self.client.put(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+
+class JobQueueTestCase(DynamicModelTestMixin, APITestCase):
+    def get_job(self, response, expected_status=JobStatus.PENDING):
+        """
+        Run the queued job and return its status.
+        """
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Job.objects.get(pk=response.data["job_id"]).status, expected_status)
+        self.assertEqual(process_jobs("test-worker"), 1)
+        job_response = self.client.get(response["Location"], format="json")
+        self.assertEqual(job_response.status_code, status.HTTP_200_OK)
+        return job_response.data
+
+    def test_async_create_table(self):
+        url = reverse('api:create_table') + "?async=true"
+        response = self.client.post(url, {"fields": {"name": "STR", "age": "NUM"}}, format="json")
+        job = self.get_job(response)
+        self.assertEqual(job["status"], JobStatus.SUCCEEDED)
+        model_id = job["result"]["model_id"]
+        self.add_table_row(model_id, data={"fields": {"name": "Adam", "age": 23}})
+        self.assertEqual(self.get_table_rows(model_id), [{"name": "Adam", "age": 23}])
+
+    def test_async_update_table(self):
+        new_model_id = self.create_table()
+        url = reverse('api:edit_table', kwargs={"id": new_model_id}) + "?async=true"
+        response = self.client.put(url, {"fields": {"insured": "BOOL"}}, format="json")
+        job = self.get_job(response)
+        self.assertEqual(job["status"], JobStatus.SUCCEEDED)
+        self.add_table_row(new_model_id, data={"fields": {"insured": True}})
+
+    def test_async_bulk_add_rows(self):
+        new_model_id = self.create_table()
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": new_model_id}) + "?async=true&batch_size=2"
+        rows = [{"name": "Adam", "age": 23}, {"name": "Mike", "height": 178}, {"name": "Eve", "age": 31}]
+        response = self.client.post(url, rows, format="json")
+        # the rows are staged in batches, outside of the job's payload
+        queued = Job.objects.get(pk=response.data["job_id"])
+        self.assertNotIn("rows", queued.payload)
+        self.assertEqual(list(queued.row_batches.order_by("pk").values_list("first_row", flat=True)), [1, 3])
+
+        job = self.get_job(response)
+        self.assertEqual(job["status"], JobStatus.SUCCEEDED)
+        self.assertEqual(job["result"]["inserted"], 2)
+        self.assertEqual([error["row"] for error in job["result"]["errors"]], [2])
+        self.assertEqual(self.get_table_rows(new_model_id), [rows[0], rows[2]])
+        self.assertFalse(queued.row_batches.exists())
+
+    @override_settings(DYNAMIC_MODEL_JOB_MAX_ROWS=2)
+    def test_async_bulk_add_rows_too_large(self):
+        new_model_id = self.create_table()
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": new_model_id}) + "?async=true"
+        response = self.client.post(url, [{"name": "Adam"}] * 3, format="json")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(Job.objects.exists())
+
+    def test_async_bulk_add_inline_rows(self):
+        """
+        Test that a load queued with its rows in the payload still runs, and the rows are dropped after.
+        """
+        new_model_id = self.create_table()
+        job = enqueue_job("BULK_ADD_ROWS", {"model_id": new_model_id, "rows": [{"name": "Adam", "age": 23}]})
+        process_jobs("test-worker")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+        self.assertEqual(job.result["inserted"], 1)
+        self.assertNotIn("rows", job.payload)
+
+    def test_async_job_failed(self):
+        job = enqueue_job("UPDATE_TABLE", {"model_id": str(uuid4()), "fields": {"name": "STR"}})
+        process_jobs("test-worker")
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIn("error", job.result)
+
+    def test_claimed_job_not_claimed_again(self):
+        job = enqueue_job("CREATE_TABLE", {"fields": {"name": "STR"}})
+        claimed = claim_job("test-worker")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.status, JobStatus.RUNNING)
+        self.assertIsNone(claim_job("other-worker"))
+
+    def test_stale_job_claimed_again(self):
+        job = enqueue_job("CREATE_TABLE", {"fields": {"name": "STR"}})
+        self.assertEqual(claim_job("dead-worker").pk, job.pk)
+        # still within its lease
+        self.assertIsNone(claim_job("other-worker"))
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs("api.jobs", "WARNING"):
+            claimed = claim_job("other-worker")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.worker, "other-worker")
+        run_job(claimed)
+        self.assertEqual(claimed.status, JobStatus.SUCCEEDED)
+
+    def test_stale_bulk_load_resumed(self):
+        """
+        Test that a bulk load whose worker died carries on with the batches it didn't load.
+        """
+        new_model_id = self.create_table()
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": new_model_id}) + "?async=true&batch_size=1"
+        rows = [{"name": "Adam", "age": 23}, {"name": "Mike", "height": 178}, {"name": "Eve", "age": 31}]
+        response = self.client.post(url, rows, format="json")
+        job = claim_job("dead-worker")
+
+        # the worker dies while loading the second batch
+        calls = []
+        def ingest_then_die(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise SystemExit
+            return ingest_rows(*args, **kwargs)
+        with mock.patch("api.jobs.ingest_rows", ingest_then_die), self.assertRaises(SystemExit):
+            JOB_HANDLERS[job.kind](job)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs("api.jobs", "WARNING"):
+            job_response = self.get_job(response, expected_status=JobStatus.RUNNING)
+        self.assertEqual(job_response["status"], JobStatus.SUCCEEDED)
+        self.assertEqual(job_response["result"]["inserted"], 2)
+        self.assertEqual([error["row"] for error in job_response["result"]["errors"]], [2])
+        self.assertEqual(self.get_table_rows(new_model_id), [rows[0], rows[2]])
+
+    def test_job_not_found(self):
+        for job_id in [uuid4(), "abc"]:
+            response = self.client.get(reverse('api:get_job', kwargs={"id": job_id}), format="json")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryBudgetTestCase(DynamicModelTestMixin, APITestCase):
+    """
+    Query budgets per endpoint, with the table's model class already cached.
+    """
+    def setUp(self):
+        self.model_id = self.create_table()
+        self.add_table_row(self.model_id)
+
+    def test_create_table_budget(self):
+        # app, table, fields, CREATE TABLE with all columns
+        with self.assertQueryBudget(4):
+            self.create_table()
+
+    def test_create_wide_table_budget(self):
+        # a single CREATE TABLE, no matter how many columns the table has
+        with self.assertQueryBudget(4):
+            self.create_table(data={"fields": {f"col_{i}": "NUM" for i in range(50)}})
+
+    def test_edit_table_budget(self):
+        url = reverse('api:edit_table', kwargs={"id": self.model_id})
+        data = {"fields": {"name": "NUM", "age": "STR", "insured": "BOOL"}}
+        # table, locked table, schema change lock, its fields, its indexes, Field inserts,
+        # Field updates, online change leftovers, unconvertible value count, ALTER TABLE,
+        # version bump and refresh
+        with self.assertQueryBudget(12):
+            response = self.client.put(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_add_table_row_budget(self):
+        # table, INSERT, row count
+        with self.assertQueryBudget(3):
+            self.add_table_row(self.model_id)
+
+    def test_add_wide_table_row_budget(self):
+        # table, INSERT, row count, no matter how many columns the row has
+        model_id = self.create_table(data={"fields": {f"col_{i}": "NUM" for i in range(50)}})
+        self.add_table_row(model_id, data={"fields": {f"col_{i}": i for i in range(50)}})
+        with self.assertQueryBudget(3):
+            self.add_table_row(model_id, data={"fields": {f"col_{i}": i for i in range(50)}})
+
+    def test_bulk_add_table_rows_budget(self):
+        # table, COPY, row count
+        url = reverse('api:bulk_add_table_rows', kwargs={"id": self.model_id})
+        with self.assertQueryBudget(3):
+            response = self.client.post(url, [{"name": "Adam", "age": 23}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_get_table_rows_budget(self):
+        # table, rows
+        with self.assertQueryBudget(2):
+            self.get_table_rows(self.model_id)
+
+
+class DBConnectionTestCase(APITestCase):
+    """
+    Connection reuse across requests, served concurrently by a pool of threads
+    with connections of their own, the way a threaded WSGI server serves them.
+    """
+    def setUp(self):
+        connection_stats.reset()
+
+    def serve_requests(self, count, conn_max_age=0, threads=4, pool=None, before_request=None):
+        """
+        Serve count requests from a pool of threads, each running a query, and closing
+        its connection when the request starts and finishes if it's obsolete, as Django does.
+        With pool options, the threads take their connections from a shared pool.
+        Returns the backend pid which served each request.
+        """
+        pids = []
+        thread_connections = []
+        local = threading.local()
+        options = {name: value for name, value in connection.settings_dict["OPTIONS"].items() if name != "pool"}
+        if pool is not None:
+            options["pool"] = pool
+        settings_dict = {
+            **connection.settings_dict,
+            "CONN_MAX_AGE": conn_max_age,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": options,
+        }
+
+        def start_thread():
+            # pools are shared per alias, so the test's pool is kept apart
+            local.connection = connections["default"].__class__(settings_dict, alias="pooled" if pool else "default")
+            # closed by the test once the threads are done
+            local.connection.inc_thread_sharing()
+            thread_connections.append(local.connection)
+
+        def serve(request):
+            if before_request is not None:
+                before_request(request, pids)
+            local.connection.close_if_unusable_or_obsolete()
+            with local.connection.cursor() as cursor:
+                # long enough for the requests to overlap
+                cursor.execute("SELECT pg_backend_pid(), pg_sleep(0.01)")
+                pids.append(cursor.fetchone()[0])
+            local.connection.close_if_unusable_or_obsolete()
+
+        try:
+            with ThreadPoolExecutor(max_workers=threads, initializer=start_thread) as executor:
+                for future in [executor.submit(serve, request) for request in range(count)]:
+                    future.result()
+        finally:
+            for thread_connection in thread_connections:
+                thread_connection.close()
+                thread_connection.dec_thread_sharing()
+            if thread_connections and pool is not None:
+                thread_connections[0].close_pool()
+        return pids
+
+    def test_persistent_connection_reused(self):
+        pids = self.serve_requests(12, conn_max_age=60, threads=4)
+        # a connection per thread, rather than per request
+        self.assertLessEqual(len(set(pids)), 4)
+        self.assertEqual(connection_stats.as_dict()["connections"], len(set(pids)))
+
+    def test_connection_per_request(self):
+        pids = self.serve_requests(8, conn_max_age=0, threads=4)
+        self.assertEqual(len(pids), 8)
+        self.assertEqual(connection_stats.as_dict()["connections"], 8)
+
+    def test_terminated_connection_replaced(self):
+        def terminate_connection(request, pids):
+            if request != 1:
+                return
+            # the server drops the persistent connection between two requests
+            other = connections.create_connection("default")
+            with other.cursor() as cursor:
+                cursor.execute("SELECT pg_terminate_backend(%s, 5000)", [pids[0]])
+            other.close()
+
+        pids = self.serve_requests(2, conn_max_age=60, threads=1, before_request=terminate_connection)
+        self.assertNotEqual(pids[0], pids[1])
+
+    def test_db_metrics(self):
+        self.serve_requests(8, conn_max_age=0, threads=4)
+        response = self.client.get(reverse('api:db_metrics'), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["connections"], 8)
+        self.assertGreater(response.data["wait_ms_total"], 0)
+        self.assertGreaterEqual(response.data["wait_ms_total"], response.data["wait_ms_max"])
+        # the serving process' own pool, if it has one
+        self.assertEqual("pool" in response.data, settings.DB_POOL)
+
+    def test_pooled_connections(self):
+        pids = self.serve_requests(24, threads=8, pool={"min_size": 1, "max_size": 3, "timeout": 10})
+        # more threads than pooled connections, which they take turns using
+        self.assertLessEqual(len(set(pids)), 3)
+        stats = connection_stats.as_dict()
+        self.assertEqual(stats["connections"], 24)
+        self.assertGreater(stats["wait_ms_max"], 0)
@@ -1,13 +1,35 @@
 from django.urls import path
-from api.views import DynamicModelCreateView, DynamicModelUpdateView, DynamicModelAddRowView, DynamicModelGetRowsView
+from api.views import (
+    DynamicModelCreateView,
+    DynamicModelBatchCreateView,
+    DynamicModelUpdateView,
+    DynamicModelAddRowView,
+    DynamicModelBulkAddRowsView,
+    DynamicModelGetRowsView,
+    DynamicModelRowView,
+    DynamicModelAggregateView,
+    DynamicModelCountView,
+    JobStatusView,
+    DBMetricsView,
+)
+from api import async_views
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 
 urlpatterns = [
     path("table/", DynamicModelCreateView.as_view(), name="create_table"),
+    path("table/batch", DynamicModelBatchCreateView.as_view(), name="create_tables"),
     path("table/<str:id>", DynamicModelUpdateView.as_view(), name="edit_table"),
     path("table/<str:id>/row", DynamicModelAddRowView.as_view(), name="add_table_row"),
     path("table/<str:id>/rows", DynamicModelGetRowsView.as_view(), name="get_table_rows"),
+    path("table/<str:id>/rows/<int:row_id>", DynamicModelRowView.as_view(), name="edit_table_row"),
+    path("table/<str:id>/rows/bulk", DynamicModelBulkAddRowsView.as_view(), name="bulk_add_table_rows"),
+    path("table/<str:id>/count", DynamicModelCountView.as_view(), name="count_table_rows"),
+    path("table/<str:id>/aggregate", DynamicModelAggregateView.as_view(), name="aggregate_table_rows"),
+    path("async/table/<str:id>/row", async_views.add_table_row, name="async_add_table_row"),
+    path("async/table/<str:id>/rows", async_views.get_table_rows, name="async_get_table_rows"),
+    path("job/<str:id>", JobStatusView.as_view(), name="get_job"),
+    path("metrics/db", DBMetricsView.as_view(), name="db_metrics"),
     path("schema/", SpectacularAPIView.as_view(), name="schema"),
     path("schema/docs/", SpectacularSwaggerView.as_view(url_name="api:schema")),
 ]
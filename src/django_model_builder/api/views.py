@@ -4,10 +4,36 @@ from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView, UpdateAPIView
 from rest_framework.response import Response
 from rest_framework import serializers
-from api.serializers import DynamicModelSerializer, DynamicModelRowSerializer, create_serializer_for_model
-from api.models import DynamicModelTable, Field
+from rest_framework.parsers import JSONParser
+from api.serializers import (
+    DynamicModelSerializer,
+    DynamicModelBatchSerializer,
+    DynamicModelRowSerializer,
+    DynamicModelRowChangesQuerySerializer,
+    DynamicModelAddRowQuerySerializer,
+    DynamicModelBulkRowsQuerySerializer,
+    DynamicModelRowsQuerySerializer,
+    DynamicModelAggregateQuerySerializer,
+    DynamicModelCountQuerySerializer,
+    DynamicModelUpdateQuerySerializer,
+    DynamicModelJobQuerySerializer,
+    JobAcceptedSerializer,
+    JobSerializer,
+    create_serializer_for_model,
+)
+from api.models import DynamicModelTable, Field, Job, JobKind, RowCountMode
+from api.jobs import enqueue_bulk_add_rows, enqueue_job
+from api.parsers import NDJSONParser, CSVParser
+from api.rows import aggregate_rows, delete_rows, filter_rows, ingest_rows, paginate_rows, stream_rows
+from api.backends.postgresql.base import connection_stats
 from drf_spectacular.utils import extend_schema, OpenApiExample, inline_serializer
-from django.http import Http404
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.utils.urls import replace_query_param
 from drf_spectacular.extensions import OpenApiViewExtension
 import ast
 import json
@@ -22,24 +48,105 @@ def string_is_valid_uuid(string):
     return True
 
 
+def job_accepted_response(request, job):
+    """
+    Answer a request whose operation was queued, pointing the client at the job's status.
+    """
+    status_url = request.build_absolute_uri(reverse("api:get_job", kwargs={"id": job.pk}))
+    return Response(
+        {"job_id": job.pk, "status": job.status},
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Location": status_url},
+    )
+
+
+def get_row_count_headers(model_table, queryset, filters):
+    """
+    Headers carrying the number of rows a rows request covers, counted the way
+    the DYNAMIC_MODEL_ROW_COUNT_MODE setting says. Filtered rows are only
+    counted in exact mode, since estimated and cached counts cover the whole table.
+    """
+    mode = settings.DYNAMIC_MODEL_ROW_COUNT_MODE
+    if not mode or (filters and mode != RowCountMode.EXACT):
+        return {}
+    count = model_table.get_row_count(mode, queryset if filters else None)
+    return {"X-Total-Count": str(count), "X-Total-Count-Mode": mode}
+
+
+def get_conditional_headers(model_table):
+    """
+    Validators of a table's rows, changing with every change of the rows or the schema.
+    """
+    return {
+        "ETag": model_table.get_etag(),
+        "Last-Modified": http_date(model_table.data_modified_at.timestamp()),
+    }
+
+
+def get_not_modified_response(request, model_table):
+    """
+    Answer If-None-Match and If-Modified-Since requests for rows that haven't changed since,
+    from the table row alone. Returns None if the rows need to be sent.
+    """
+    # a 304 carries the same validators as the full response
+    validators = HttpResponse(headers=get_conditional_headers(model_table))
+    response = get_conditional_response(
+        request,
+        etag=model_table.get_etag(),
+        last_modified=int(model_table.data_modified_at.timestamp()),
+        response=validators,
+    )
+    return None if response is validators else response
+
+
+class DynamicModelTableMixin:
+    """
+    Resolves the dynamic model table from the view's 'id' URL argument.
+    The table is looked up once per request, no matter how often
+    get_object() is called while handling it.
+    """
+    def get_object(self):
+        if getattr(self, "_model_table", None) is None:
+            model_id = self.kwargs.get("id")
+            if not string_is_valid_uuid(model_id):
+                raise Http404
+            try:
+                self._model_table = DynamicModelTable.objects.get(model_id=model_id)
+            except DynamicModelTable.DoesNotExist:
+                raise Http404
+        return self._model_table
+
+
 @extend_schema(
+    parameters=[DynamicModelJobQuerySerializer],
     responses = {
         201: DynamicModelSerializer,
+        202: JobAcceptedSerializer,
         400: DynamicModelSerializer,
     },
     examples = [
          OpenApiExample(
             'Valid table creation example',
             summary='Valid dynamic model structure',
-            description='The only input field is \'fields\', which takes a dictionary. ' \
+            description='The main input field is \'fields\', which takes a dictionary. ' \
                 'The keys are the model field names, and the values are the field data types. ' \
-                'There are three options: STR, NUM, and BOOL.',
+                'There are three options: STR, NUM, and BOOL. ' \
+                'The optional \'indexes\' field declares indexes on the model\'s fields, ' \
+                'which speed up filtered reads. An index covers one or more \'fields\', can be \'unique\', ' \
+                'and can be limited to the rows matching a \'condition\' on BOOL fields. ' \
+                'The table is created with all of its columns and indexes in a single statement. ' \
+                'The optional \'natural_key\' field lists the fields identifying a row, e.g. [\'name\'], ' \
+                'which rows can then be upserted by. It\'s enforced by a unique index, and can\'t change later.',
             value={
                 'fields': {
                     'name': "STR",
                     'age': "NUM",
                     "insured": "BOOL"
-                }
+                },
+                'indexes': [
+                    {'fields': ["name", "age"], 'unique': True},
+                    {'fields': ["age"], 'condition': {"insured": True}}
+                ]
             },
             request_only=True, # signal that example only applies to requests
         ),
@@ -67,6 +174,18 @@ def string_is_valid_uuid(string):
             },
             response_only=True, # signal that example only applies to responses
         ),
+        OpenApiExample(
+            'Table creation 202 response',
+            summary='Table creation queued',
+            description='Returned instead when \'async=true\' is passed. ' \
+                'The operation runs in a worker, its progress can be polled at the URL in the \'Location\' header.',
+            status_codes=[202,],
+            value={
+                "job_id": uuid.uuid4(),
+                "status": "PENDING"
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
         OpenApiExample(
             'Table creation 400 response',
             summary='Invalid table field declaration',
@@ -89,18 +208,110 @@ class DynamicModelCreateView(GenericAPIView):
     queryset = DynamicModelTable.objects.none()
 
     def post(self, request, format=None):
+        query_serializer = DynamicModelJobQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         serializer = DynamicModelSerializer(data=request.data)
         if serializer.is_valid():
+            if query_serializer.validated_data["async"]:
+                job = enqueue_job(JobKind.CREATE_TABLE, {
+                    "fields": serializer.validated_data["fields"],
+                    "indexes": serializer.validated_data.get("indexes", []),
+                    "natural_key": serializer.validated_data.get("natural_key", []),
+                })
+                return job_accepted_response(request, job)
             new_model_id = serializer.save()
             return Response(new_model_id, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @extend_schema(
+    responses = {
+        201: inline_serializer(
+            name="DynamicModelBatchResponse",
+            fields={
+                "model_ids": serializers.ListField(child=serializers.UUIDField()),
+            },
+        ),
+        400: DynamicModelBatchSerializer,
+    },
+    examples = [
+         OpenApiExample(
+            'Batch table creation example',
+            summary='Create many dynamic models',
+            description='\'tables\' takes a list of model declarations, each one as in the table creation view. ' \
+                'Either all of the tables are created, or none of them. ' \
+                'The IDs of the new models are returned in the order of their declarations.',
+            value={
+                'tables': [
+                    {
+                        'fields': {
+                            'name': "STR",
+                            'age': "NUM",
+                        },
+                        'natural_key': ['name'],
+                    },
+                    {
+                        'fields': {
+                            'city': "STR",
+                            'insured': "BOOL",
+                        },
+                    },
+                ]
+            },
+            request_only=True, # signal that example only applies to requests
+        ),
+        OpenApiExample(
+            'Batch table creation 201 response',
+            summary='Successful batch table creation response',
+            description='',
+            status_codes=[201,],
+            value={
+                'model_ids': [uuid.uuid4(), uuid.uuid4()],
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Batch table creation 400 response',
+            summary='Invalid table declaration',
+            description='The second declaration has an invalid field type, so no table was created.',
+            status_codes=[400,],
+            value={
+                'tables': {
+                    '1': {
+                        'fields': {
+                            'date': ["\"DATE\" is not a valid choice."]
+                        }
+                    }
+                }
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DynamicModelBatchCreateView(GenericAPIView):
+    """
+    Create many dynamic models at once.
+    """
+    serializer_class = DynamicModelBatchSerializer
+    queryset = DynamicModelTable.objects.none()
+
+    def post(self, request, format=None):
+        serializer = DynamicModelBatchSerializer(data=request.data)
+        if serializer.is_valid():
+            result = serializer.save()
+            return Response(result, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(
+    parameters=[DynamicModelUpdateQuerySerializer],
     responses = {
         200: DynamicModelSerializer,
+        202: JobAcceptedSerializer,
         400: DynamicModelSerializer,
-        404: DynamicModelSerializer
+        404: DynamicModelSerializer,
+        409: DynamicModelSerializer,
     },
     examples = [
          OpenApiExample(
@@ -110,8 +321,15 @@ class DynamicModelCreateView(GenericAPIView):
                 'The keys are the model field names, and the values are the field data types. ' \
                 'There are three options: STR, NUM, and BOOL. ' \
                 'The provided fields are checked against the existing model structure. ' \
-                'new fields are added, and fields with the same name are dropped and replaced ' \
-                'with the new field, but only if there was a data type change (e.g. from STR to NUM).',
+                'new fields are added, and fields with the same name are converted to the new data type ' \
+                'if there was a data type change (e.g. from STR to NUM). ' \
+                'Values which can\'t be converted are set to null, and counted per field in the response. ' \
+                'Fields covered by a unique index, the natural key included, keep their data type. ' \
+                'Indexes in \'indexes\' are added, if the model doesn\'t have them already. ' \
+                'Indexes which can\'t be built, e.g. unique ones over duplicate values, are listed in \'index_errors\'. ' \
+                'Pass \'online=true\' to keep a large table writable while its schema changes. ' \
+                'Retyped columns are then converted in batches, while reads and writes continue. ' \
+                'Updates which find another one still changing the table\'s schema get a 409 response.',
             value={
                 'fields': {
                     'name': "STR",
@@ -136,14 +354,29 @@ class DynamicModelCreateView(GenericAPIView):
         OpenApiExample(
             'Table update 200 response',
             summary='Successful table update response',
-            description='',
+            description='\'nulled_values\' is only present if some values couldn\'t be converted.',
             value={
                 'fields': {
                     'model_id': uuid.uuid4(),
+                    'nulled_values': {
+                        'age': 2,
+                    },
                 }
             },
             response_only=True, # signal that example only applies to responses
         ),
+        OpenApiExample(
+            'Table update 202 response',
+            summary='Table update queued',
+            description='Returned instead when \'async=true\' is passed. ' \
+                'The operation runs in a worker, its progress can be polled at the URL in the \'Location\' header.',
+            status_codes=[202,],
+            value={
+                "job_id": uuid.uuid4(),
+                "status": "PENDING"
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
         OpenApiExample(
             'Table creation 400 response',
             summary='Invalid table field declaration',
@@ -166,36 +399,54 @@ class DynamicModelCreateView(GenericAPIView):
             },
             response_only=True, # signal that example only applies to responses
         ),
+        OpenApiExample(
+            'Table update 409 response',
+            summary='Table locked',
+            description='Error response thrown when an online update couldn\'t lock the table in time.',
+            status_codes=[409,],
+            value={
+                "error": "Timed out waiting for a lock on the table, try again later."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
     ]
 )
-class DynamicModelUpdateView(GenericAPIView):
+class DynamicModelUpdateView(DynamicModelTableMixin, GenericAPIView):
     """
     Update dynamic model.
     """
     serializer_class = DynamicModelSerializer
     queryset = DynamicModelTable.objects.none()
 
-    def get_object(self, model_id):
-        if not string_is_valid_uuid(model_id):
-            raise Http404
-        try:
-            return DynamicModelTable.objects.get(model_id=model_id)
-        except DynamicModelTable.DoesNotExist:
-            raise Http404
-    
     def put(self, request, *args, **kwargs):
-        model = self.get_object(self.kwargs.get("id"))
+        model = self.get_object()
+        query_serializer = DynamicModelUpdateQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         serializer = DynamicModelSerializer(
             data=request.data,
             context={"model_id": model.model_id}
         )
         if serializer.is_valid() and not serializer.data.get("error"):
-            updated_model = serializer.update_model(model.model_id)
+            if query_serializer.validated_data["async"]:
+                job = enqueue_job(JobKind.UPDATE_TABLE, {
+                    "model_id": str(model.model_id),
+                    "fields": serializer.validated_data["fields"],
+                    "indexes": serializer.validated_data.get("indexes", []),
+                    "online": query_serializer.validated_data["online"],
+                })
+                return job_accepted_response(request, job)
+            updated_model = serializer.update_model(
+                model.model_id, online=query_serializer.validated_data["online"]
+            )
+            if updated_model.get("error"):
+                return Response(updated_model, status=status.HTTP_409_CONFLICT)
             return Response(updated_model, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @extend_schema(
+    parameters=[DynamicModelAddRowQuerySerializer],
     responses = {
         201: DynamicModelRowSerializer,
         400: DynamicModelRowSerializer,
@@ -208,7 +459,9 @@ class DynamicModelUpdateView(GenericAPIView):
             description='To add a row to a dynamic model, pass the \'fields\' argument. ' \
                 'The keys are the model field names, and the values are the row values. ' \
                 'dynamic model fields are nullable, so you can omit values. ' \
-                'If there is an unexpected input field, or an incompatible value, an error is thrown.',
+                'If there is an unexpected input field, or an incompatible value, an error is thrown. ' \
+                'With \'upsert=true\', a row with the same natural key values replaces the existing row, ' \
+                'fields missing from the request are set to null. The natural key fields are required then.',
             value={
                 "fields": {
                     "name": "Adam",
@@ -267,24 +520,22 @@ class DynamicModelUpdateView(GenericAPIView):
         ),
     ]
 )
-class DynamicModelAddRowView(GenericAPIView):
+class DynamicModelAddRowView(DynamicModelTableMixin, GenericAPIView):
     """
     Add row to dynamic model table.
     """
     serializer_class = DynamicModelRowSerializer
     
-    def get_object(self, model_id):
-        if not string_is_valid_uuid(model_id):
-            raise Http404
-        try:
-            return DynamicModelTable.objects.get(model_id=model_id)
-        except DynamicModelTable.DoesNotExist:
-            raise Http404
-    
     def post(self, request, *args, **kwargs):
-        model_table = self.get_object(self.kwargs.get("id"))
+        model_table = self.get_object()
+        query_serializer = DynamicModelAddRowQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = DynamicModelRowSerializer(data=request.data, context={"model_table": model_table})
+        serializer = DynamicModelRowSerializer(
+            data=request.data,
+            context={"model_table": model_table, "upsert": query_serializer.validated_data["upsert"]},
+        )
         if serializer.is_valid():
             result = serializer.save()
             if result.get("error"):
@@ -294,6 +545,158 @@ class DynamicModelAddRowView(GenericAPIView):
 
 
 @extend_schema(
+    parameters=[DynamicModelBulkRowsQuerySerializer],
+    request={
+        "application/json": inline_serializer(
+            name="DynamicModelBulkRowsRequest",
+            fields={
+                "name": serializers.CharField(),
+                "age": serializers.IntegerField(),
+                "insured": serializers.BooleanField(),
+            },
+            many=True,
+        ),
+        "application/x-ndjson": str,
+        "text/csv": str,
+    },
+    responses = {
+        201: inline_serializer(
+            name="DynamicModelBulkRowsResponse",
+            fields={
+                "inserted": serializers.IntegerField(),
+                "error_count": serializers.IntegerField(),
+                "errors": serializers.ListField(child=serializers.DictField()),
+            },
+        ),
+        202: JobAcceptedSerializer,
+        400: inline_serializer(
+            name="DynamicModelBulkRowsErrorResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+        404: inline_serializer(
+            name="DynamicModelBulkRowsNotFoundResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+        413: inline_serializer(
+            name="DynamicModelBulkRowsTooLargeResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+    },
+    examples = [
+         OpenApiExample(
+            'Valid bulk row insertion example',
+            summary='Valid dynamic model rows',
+            description='To add many rows at once, send a JSON array of rows, ' \
+                'newline delimited JSON (application/x-ndjson), or CSV with a header row (text/csv). ' \
+                'Every row is validated against the model\'s fields. ' \
+                'Invalid rows are skipped and reported, the remaining rows are inserted in batches ' \
+                'of \'batch_size\' rows. With \'upsert=true\', rows replace the existing rows with the same ' \
+                'natural key values, with a single statement per batch, and are counted as \'upserted\'. ' \
+                'If a streamed body turns out to be malformed, the rows read before it are kept, ' \
+                'and the parse error is reported at the row number it was hit at.',
+            value={"name": "Adam", "age": 23, "insured": True},
+            request_only=True, # signal that example only applies to requests
+        ),
+        OpenApiExample(
+            'Bulk row insertion 201 response',
+            summary='Bulk row insertion response with a rejected row',
+            description='The second row was rejected due to an incorrect value.',
+            status_codes=[201,],
+            value={
+                "inserted": 1,
+                "error_count": 1,
+                "errors": [
+                    {"row": 2, "errors": {"insured": ["“Foo” value must be either True, False, or None."]}}
+                ]
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Bulk row insertion 202 response',
+            summary='Bulk row insertion queued',
+            description='Returned instead when \'async=true\' is passed. ' \
+                'The operation runs in a worker, its progress can be polled at the URL in the \'Location\' header. ' \
+                'The rows are staged until the worker loads them, and queued loads are limited in size: ' \
+                'larger uploads get a 413 response.',
+            status_codes=[202,],
+            value={
+                "job_id": uuid.uuid4(),
+                "status": "PENDING"
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Table creation 404 response',
+            summary='Table not found',
+            description='Error response thrown due to table not being found.',
+            status_codes=[404,],
+            value={
+                "detail": "Not found."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DynamicModelBulkAddRowsView(DynamicModelTableMixin, GenericAPIView):
+    """
+    Add many rows to dynamic model table.
+    """
+    parser_classes = [JSONParser, NDJSONParser, CSVParser]
+    serializer_class = DynamicModelBulkRowsQuerySerializer
+
+    def post(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        query_serializer = DynamicModelBulkRowsQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = request.data
+        if not isinstance(rows, list) and not hasattr(rows, "__next__"):
+            return Response({"detail": "Expected a list of rows."}, status=status.HTTP_400_BAD_REQUEST)
+
+        upsert = query_serializer.validated_data["upsert"]
+        if upsert and not model_table.natural_key:
+            return Response(
+                {"upsert": ["The table has no natural key to upsert rows by."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if query_serializer.validated_data["async"]:
+            # the rows are staged in batches for the job, so streamed uploads are read here
+            job = enqueue_bulk_add_rows({
+                "model_id": str(model_table.model_id),
+                "batch_size": query_serializer.validated_data.get("batch_size"),
+                "upsert": upsert,
+            }, rows)
+            if job is None:
+                return Response(
+                    {"detail": f"Queued loads take at most {settings.DYNAMIC_MODEL_JOB_MAX_ROWS} rows."},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+            return job_accepted_response(request, job)
+
+        django_model = model_table.get_django_model()
+        result = ingest_rows(
+            django_model,
+            rows,
+            batch_size=query_serializer.validated_data.get("batch_size"),
+            model_table=model_table,
+            natural_key=model_table.natural_key if upsert else None,
+        )
+        if not result.get("upserted" if upsert else "inserted") and result["error_count"]:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+
+@extend_schema(
+    methods=["GET"],
+    parameters=[DynamicModelRowsQuerySerializer],
     responses = {
         200: inline_serializer(
             name="DynamicModelRowResponse",
@@ -303,6 +706,7 @@ class DynamicModelAddRowView(GenericAPIView):
                 "insured": serializers.BooleanField(),
             },
         ),
+        304: None,
         404: inline_serializer(
             name="DynamicModelRowErrorResponse",
             fields={
@@ -315,8 +719,18 @@ class DynamicModelAddRowView(GenericAPIView):
             'Successful table data fetch example',
             summary='Successful table data fetch',
             description='To get dynamic model data, simply call a GET request with the model id. ' \
-                'The view finds the relevant model, constructs a serializer dynamically, ' \
-                'and processes the queryset data into a response.',
+                'The view finds the relevant model and renders its rows into a response. ' \
+                'Rows are returned in pages of \'limit\' rows, ordered by insertion. ' \
+                'If there are more rows, the response carries a \'Link\' header with the URL ' \
+                'of the next page. Pass \'stream=true\' to receive all rows as newline delimited JSON instead. ' \
+                '\'fields\' selects the returned columns (e.g. \'fields=name,id\'), and \'ordering\' sorts the rows ' \
+                '(e.g. \'ordering=-age,name\'). Any other parameter filters the rows, as \'<column>__<lookup>=<value>\', ' \
+                'with the lookups eq (the default), lt, gt, in (comma separated values), contains and isnull. ' \
+                'e.g. \'age__gt=30&name__contains=Ad\'. Numbers support eq, lt, gt, in and isnull, ' \
+                'booleans eq, in and isnull. The \'X-Total-Count\' header carries the number of rows, ' \
+                'counted as the \'X-Total-Count-Mode\' header says, see the row count view. ' \
+                'Responses carry an \'ETag\' and a \'Last-Modified\' header. Send them back as ' \
+                '\'If-None-Match\' or \'If-Modified-Since\' to get an empty 304 response while the table is unchanged.',
             request_only=True, # signal that example only applies to requests
         ),
         OpenApiExample(
@@ -351,41 +765,530 @@ class DynamicModelAddRowView(GenericAPIView):
         ),
     ]
 )
-class DynamicModelGetRowsView(GenericAPIView):
+class DynamicModelGetRowsView(DynamicModelTableMixin, GenericAPIView):
     """
-    Get a dynamic model table's row data.
+    Get, update or delete a dynamic model table's row data.
     """
-    def get_object(self, model_id):
-        if not string_is_valid_uuid(model_id):
-            raise Http404
-        try:
-            return DynamicModelTable.objects.get(model_id=model_id)
-        except DynamicModelTable.DoesNotExist:
-            raise Http404
-    
     def get_serializer_class(self):
-        model = self.get_object(self.kwargs.get("id"))
-        django_model = model.get_django_model()
-        return create_serializer_for_model(django_model)
+        model = self.get_object()
+        return create_serializer_for_model(model.get_django_model())
 
     def get_queryset(self):
-        model = self.get_object(self.kwargs.get("id"))
+        model = self.get_object()
         django_model = model.get_django_model()
         return django_model.objects.all()
 
     
     def get(self, request, *args, **kwargs):
         # get relevant Django model
-        model_table = self.get_object(self.kwargs.get("id"))
+        model_table = self.get_object()
+        # clients with an up to date copy are answered without reading the rows
+        not_modified = get_not_modified_response(request, model_table)
+        if not_modified is not None:
+            return not_modified
         django_model = model_table.get_django_model()
+        query_serializer = DynamicModelRowsQuerySerializer(
+            data=request.query_params, context={"django_model": django_model}
+        )
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+        column_names = params.get("fields") or [
+            f.name for f in django_model._meta.concrete_fields if not f.primary_key
+        ]
+        # filters, ordering and projection are compiled into a single query
+        queryset = filter_rows(django_model.objects.all(), params["filters"])
+        headers = get_row_count_headers(model_table, queryset, params["filters"])
+        headers.update(get_conditional_headers(model_table))
 
-        # create dict from queryset for serializer
-        # (dynamically created model serializer won't accept a queryset)
-        queryset = list(django_model.objects.all().values(*tuple(field.name for field in django_model._meta.get_fields())))
-        serializer_class = self.get_serializer_class()
-        model_serializer = serializer_class(data=queryset, many=True)
-    
-        if model_serializer.is_valid():
-            return Response(model_serializer.data, status=status.HTTP_200_OK)
-        
-        return Response(model_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if params["stream"]:
+            return StreamingHttpResponse(
+                stream_rows(queryset, column_names, cursor=params.get("cursor"), ordering=params["ordering"]),
+                content_type="application/x-ndjson",
+                headers=headers,
+            )
+
+        # fetch a single page of rows, seeking past the cursor's position.
+        # values() already returns typed Python values for every FieldType,
+        # so rows read from the DB are rendered as is, without re-validating them.
+        limit = params.get("limit", settings.DYNAMIC_MODEL_ROWS_PAGE_SIZE)
+        rows, next_cursor = paginate_rows(
+            queryset, column_names, limit, cursor=params.get("cursor"), ordering=params["ordering"]
+        )
+        if next_cursor is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), "cursor", next_cursor)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return Response(rows, status=status.HTTP_200_OK, headers=headers)
+
+    def get_filtered_queryset(self, model_table):
+        """
+        Return the table's rows matched by the request's filter parameters,
+        or None if they are invalid, along with the filter errors.
+        """
+        django_model = model_table.get_django_model()
+        filters_serializer = DynamicModelRowChangesQuerySerializer(
+            data=self.request.query_params, context={"django_model": django_model}
+        )
+        if not filters_serializer.is_valid():
+            return None, filters_serializer.errors
+        return filter_rows(django_model.objects.all(), filters_serializer.validated_data["filters"]), None
+
+    @extend_schema(
+        request=DynamicModelRowSerializer,
+        parameters=[DynamicModelRowChangesQuerySerializer],
+        responses={
+            200: inline_serializer(
+                name="DynamicModelUpdateRowsResponse",
+                fields={
+                    "updated": serializers.IntegerField(),
+                },
+            ),
+            400: DynamicModelRowSerializer,
+            404: DynamicModelRowSerializer,
+        },
+        examples=[
+            OpenApiExample(
+                'Table rows update example',
+                summary='Update table rows',
+                description='Sets the values in \'fields\' on every row matched by the filter parameters, ' \
+                    'which work as in the get rows view (e.g. \'?name=Adam&age__lt=30\'). ' \
+                    'Without filters the request is rejected, unless \'all=true\' is passed to update every row, ' \
+                    'so a request which lost its filters can\'t change the whole table. ' \
+                    'The rows are updated with a single statement, and their number is returned.',
+                value={
+                    "fields": {
+                        "insured": True
+                    }
+                },
+                request_only=True, # signal that example only applies to requests
+            ),
+            OpenApiExample(
+                'Table rows update 200 response',
+                summary='Successful table rows update response',
+                description='',
+                status_codes=[200,],
+                value={
+                    "updated": 12
+                },
+                response_only=True, # signal that example only applies to responses
+            ),
+        ],
+    )
+    def patch(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        queryset, errors = self.get_filtered_queryset(model_table)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = DynamicModelRowSerializer(queryset, data=request.data, context={"model_table": model_table})
+        if serializer.is_valid():
+            result = serializer.save()
+            if result.get("error"):
+                return Response(result, status=status.HTTP_400_BAD_REQUEST)
+            return Response(result, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @extend_schema(
+        request=None,
+        parameters=[DynamicModelRowChangesQuerySerializer],
+        responses={
+            200: inline_serializer(
+                name="DynamicModelDeleteRowsResponse",
+                fields={
+                    "deleted": serializers.IntegerField(),
+                },
+            ),
+            400: inline_serializer(
+                name="DynamicModelDeleteRowsErrorResponse",
+                fields={
+                    "height": serializers.ListField(child=serializers.CharField()),
+                },
+            ),
+            404: inline_serializer(
+                name="DynamicModelDeleteRowsNotFoundResponse",
+                fields={
+                    "detail": serializers.CharField(),
+                },
+            ),
+        },
+        examples=[
+            OpenApiExample(
+                'Table rows deletion 200 response',
+                summary='Successful table rows deletion response',
+                description='Deletes every row matched by the filter parameters, ' \
+                    'which work as in the get rows view (e.g. \'?insured=false\'). ' \
+                    'Without filters the request is rejected, unless \'all=true\' is passed to delete every row. ' \
+                    'The rows are deleted with a single statement, and their number is returned.',
+                status_codes=[200,],
+                value={
+                    "deleted": 3
+                },
+                response_only=True, # signal that example only applies to responses
+            ),
+        ],
+    )
+    def delete(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        queryset, errors = self.get_filtered_queryset(model_table)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            deleted = delete_rows(queryset, model_table=model_table)
+        except Exception as e:
+            return Response({"error": getattr(e, "messages", [str(e)])}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"deleted": deleted}, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    request=DynamicModelRowSerializer,
+    responses={
+        200: inline_serializer(
+            name="DynamicModelUpdateRowResponse",
+            fields={
+                "updated": serializers.IntegerField(),
+            },
+        ),
+        400: DynamicModelRowSerializer,
+        404: DynamicModelRowSerializer,
+    },
+    examples=[
+        OpenApiExample(
+            'Table row update example',
+            summary='Update a table row',
+            description='Sets the values in \'fields\' on the row with the given id. ' \
+                'Columns missing from \'fields\' keep their values.',
+            value={
+                "fields": {
+                    "age": 24
+                }
+            },
+            request_only=True, # signal that example only applies to requests
+        ),
+        OpenApiExample(
+            'Table row update 404 response',
+            summary='Row not found',
+            description='Error response thrown due to the table or the row not being found.',
+            status_codes=[404,],
+            value={
+                "detail": "Not found."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DynamicModelRowView(DynamicModelTableMixin, GenericAPIView):
+    """
+    Update a single row of a dynamic model table.
+    """
+    serializer_class = DynamicModelRowSerializer
+
+    @extend_schema(operation_id="table_row_partial_update")
+    def patch(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        queryset = model_table.get_django_model().objects.filter(pk=self.kwargs["row_id"])
+
+        serializer = DynamicModelRowSerializer(queryset, data=request.data, context={"model_table": model_table})
+        if serializer.is_valid():
+            result = serializer.save()
+            if result.get("error"):
+                return Response(result, status=status.HTTP_400_BAD_REQUEST)
+            if not result["updated"]:
+                raise Http404
+            return Response(result, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(
+    parameters=[DynamicModelCountQuerySerializer],
+    responses = {
+        200: inline_serializer(
+            name="DynamicModelCountResponse",
+            fields={
+                "count": serializers.IntegerField(),
+                "mode": serializers.CharField(),
+            },
+        ),
+        400: inline_serializer(
+            name="DynamicModelCountErrorResponse",
+            fields={
+                "mode": serializers.ListField(child=serializers.CharField()),
+            },
+        ),
+        404: inline_serializer(
+            name="DynamicModelCountNotFoundResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+    },
+    examples = [
+         OpenApiExample(
+            'Table row count example',
+            summary='Count table rows',
+            description='Counts the table\'s rows. With \'mode=exact\' the rows are counted, ' \
+                'which takes long on large tables. \'mode=estimate\' returns the database\'s estimate ' \
+                'from its table statistics, and \'mode=cached\' a count kept up to date as rows are added. ' \
+                'Without a mode, the configured default is used. ' \
+                'Rows can be filtered with the same parameters as the get rows view, which requires an exact count.',
+            request_only=True, # signal that example only applies to requests
+        ),
+        OpenApiExample(
+            'Table row count 200 response',
+            summary='Successful table row count response',
+            description='',
+            status_codes=[200,],
+            value={
+                "count": 48213904,
+                "mode": "estimate"
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Table row count 404 response',
+            summary='Table not found',
+            description='Error response thrown due to table not being found.',
+            status_codes=[404,],
+            value={
+                "detail": "Not found."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DynamicModelCountView(DynamicModelTableMixin, GenericAPIView):
+    """
+    Count a dynamic model table's rows.
+    """
+    serializer_class = DynamicModelCountQuerySerializer
+
+    def get(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        django_model = model_table.get_django_model()
+        query_serializer = DynamicModelCountQuerySerializer(
+            data=request.query_params, context={"django_model": django_model}
+        )
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+        queryset = None
+        if params["filters"]:
+            queryset = filter_rows(django_model.objects.all(), params["filters"])
+        count = model_table.get_row_count(params["mode"], queryset)
+        return Response({"count": count, "mode": params["mode"]}, status=status.HTTP_200_OK)
+
+@extend_schema(
+    parameters=[DynamicModelAggregateQuerySerializer],
+    responses = {
+        200: inline_serializer(
+            name="DynamicModelAggregateResponse",
+            fields={
+                "insured": serializers.BooleanField(),
+                "count": serializers.IntegerField(),
+                "age__avg": serializers.FloatField(),
+            },
+        ),
+        400: inline_serializer(
+            name="DynamicModelAggregateErrorResponse",
+            fields={
+                "metrics": serializers.ListField(child=serializers.CharField()),
+            },
+        ),
+        404: inline_serializer(
+            name="DynamicModelAggregateNotFoundResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+    },
+    examples = [
+         OpenApiExample(
+            'Table aggregation example',
+            summary='Aggregate table rows',
+            description='Computes \'metrics\' over the table\'s rows in the database, ' \
+                'so only the results are transferred. ' \
+                'Metrics are \'count\', counting rows, or \'<field>__<function>\' on NUM fields, ' \
+                'with the functions count, sum, avg, min and max (e.g. \'metrics=count,age__avg\'). ' \
+                'Pass \'group_by\' with STR or BOOL fields to compute the metrics per group of values ' \
+                '(e.g. \'group_by=insured\'). Groups come in pages of at most \'limit\', ' \
+                'ordered by the group values; the \'Link\' header holds the next page\'s \'cursor\'. ' \
+                'Rows can be filtered with the same parameters as the get rows view (e.g. \'age__gt=30\').',
+            request_only=True, # signal that example only applies to requests
+        ),
+        OpenApiExample(
+            'Table aggregation 200 response',
+            summary='Successful table aggregation response',
+            description='Response to \'?group_by=insured&metrics=count,age__avg\'.',
+            status_codes=[200,],
+            value=[
+                {
+                    "insured": False,
+                    "count": 12,
+                    "age__avg": 34.5
+                },
+                {
+                    "insured": True,
+                    "count": 30,
+                    "age__avg": 41.2
+                }
+            ],
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Table aggregation 400 response',
+            summary='Invalid metric',
+            description='This request failed because \'name\' is not a NUM field.',
+            status_codes=[400,],
+            value={
+                "metrics": [
+                    "Field 'name' is not a NUM field."
+                ]
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Table aggregation 404 response',
+            summary='Table not found',
+            description='Error response thrown due to table not being found.',
+            status_codes=[404,],
+            value={
+                "detail": "Not found."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DynamicModelAggregateView(DynamicModelTableMixin, GenericAPIView):
+    """
+    Aggregate a dynamic model table's rows.
+    """
+    serializer_class = DynamicModelAggregateQuerySerializer
+
+    def get(self, request, *args, **kwargs):
+        model_table = self.get_object()
+        django_model = model_table.get_django_model()
+        query_serializer = DynamicModelAggregateQuerySerializer(
+            data=request.query_params, context={"django_model": django_model}
+        )
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = query_serializer.validated_data
+        queryset = filter_rows(django_model.objects.all(), params["filters"])
+        results, next_cursor = aggregate_rows(
+            queryset,
+            params.get("group_by", []),
+            params["metrics"],
+            limit=params.get("limit", settings.DYNAMIC_MODEL_ROWS_PAGE_SIZE),
+            cursor=params.get("cursor"),
+        )
+        headers = {}
+        if next_cursor is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), "cursor", next_cursor)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return Response(results, status=status.HTTP_200_OK, headers=headers)
+
+@extend_schema(
+    responses = {
+        200: JobSerializer,
+        404: inline_serializer(
+            name="JobNotFoundResponse",
+            fields={
+                "detail": serializers.CharField(),
+            },
+        ),
+    },
+    examples = [
+        OpenApiExample(
+            'Job status 200 response',
+            summary='Finished job',
+            description='\'status\' is one of PENDING, RUNNING, SUCCEEDED and FAILED. ' \
+                'Once the job has finished, \'result\' holds what the synchronous endpoint would have returned. ' \
+                'A running job whose worker stops responding is run again by another worker, ' \
+                'bulk loads carry on with the rows which weren\'t loaded yet.',
+            status_codes=[200,],
+            value={
+                "id": uuid.uuid4(),
+                "kind": "UPDATE_TABLE",
+                "status": "SUCCEEDED",
+                "result": {
+                    "model_id": uuid.uuid4(),
+                },
+                "created_at": "2024-03-01T12:00:00Z",
+                "started_at": "2024-03-01T12:00:01Z",
+                "finished_at": "2024-03-01T12:00:04Z"
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+        OpenApiExample(
+            'Job status 404 response',
+            summary='Job not found',
+            description='Error response thrown due to job not being found.',
+            status_codes=[404,],
+            value={
+                "detail": "Not found."
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class JobStatusView(GenericAPIView):
+    """
+    Get the status of a queued table operation.
+    """
+    serializer_class = JobSerializer
+    queryset = Job.objects.all()
+
+    def get(self, request, *args, **kwargs):
+        job_id = self.kwargs.get("id")
+        if not string_is_valid_uuid(job_id):
+            raise Http404
+        try:
+            job = Job.objects.get(pk=job_id)
+        except Job.DoesNotExist:
+            raise Http404
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    responses = {
+        200: inline_serializer(
+            name="DBMetricsResponse",
+            fields={
+                "connections": serializers.IntegerField(),
+                "wait_ms_total": serializers.FloatField(),
+                "wait_ms_max": serializers.FloatField(),
+                "conn_max_age": serializers.IntegerField(allow_null=True),
+                "pool": serializers.DictField(required=False),
+            },
+        ),
+    },
+    examples = [
+        OpenApiExample(
+            'DB metrics 200 response',
+            summary='DB connection metrics',
+            description='Counts the DB connections this process opened, or took from the pool, ' \
+                'and the milliseconds spent waiting for them. With persistent connections ' \
+                '(\'conn_max_age\' above 0) the count stays close to the number of worker threads. ' \
+                'When a connection pool is configured, \'pool\' holds its statistics.',
+            status_codes=[200,],
+            value={
+                "connections": 8,
+                "wait_ms_total": 21.4,
+                "wait_ms_max": 4.2,
+                "conn_max_age": 60
+            },
+            response_only=True, # signal that example only applies to responses
+        ),
+    ]
+)
+class DBMetricsView(APIView):
+    """
+    Get the DB connection metrics of the process serving the request.
+    """
+    def get(self, request, *args, **kwargs):
+        metrics = connection_stats.as_dict()
+        metrics["conn_max_age"] = connection.settings_dict["CONN_MAX_AGE"]
+        # only set with the pool option, see POSTGRES_POOL
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            metrics["pool"] = pool.get_stats()
+        return Response(metrics, status=status.HTTP_200_OK)
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_model_builder.settings")
+# async views run their queries on changing threads, which persistent connections
+# don't survive well, so connections are reused through the pool unless configured
+os.environ.setdefault("POSTGRES_CONN_MAX_AGE", "0")
+os.environ.setdefault("POSTGRES_POOL", "1")
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+from django.core.exceptions import ImproperlyConfigured
 import os
 from pathlib import Path
 
@@ -93,17 +94,46 @@ DB_IS_AVAIL = all([DB_USERNAME, DB_PASSWORD, DB_DATABASE, DB_HOST])
 if not DB_IS_AVAIL:
     raise ImproperlyConfigured("Missing one or more Postgres DB connection variables.")
 
+# Persistent connections: seconds a connection is reused by later requests (0 closes it
+# after every request), and whether it's checked before a request reuses it
+DB_CONN_MAX_AGE = int(os.environ.get("POSTGRES_CONN_MAX_AGE", "60"))
+DB_CONN_HEALTH_CHECKS = bool(os.environ.get("POSTGRES_CONN_HEALTH_CHECKS", "1") == "1")
+
+# Take connections from a psycopg 3 pool instead, with at least min and at most max connections
+# per process, waiting at most POSTGRES_POOL_TIMEOUT seconds for a free one
+DB_POOL = bool(os.environ.get("POSTGRES_POOL", "0") == "1")
+DB_POOL_MIN_SIZE = int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("POSTGRES_POOL_TIMEOUT", "10"))
+
+# Waiting longer than this many milliseconds for a connection is logged as a warning
+DB_CONNECTION_WAIT_WARNING = float(os.environ.get("POSTGRES_CONNECTION_WAIT_WARNING", "100"))
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        # records the time spent waiting for connections, see /api/metrics/db
+        "ENGINE": "api.backends.postgresql",
         "NAME": DB_DATABASE,
         "USER": DB_USERNAME,
         "PASSWORD": DB_PASSWORD,
         "HOST": DB_HOST,
         "PORT": "5432",
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
     }
 }
 
+if DB_POOL:
+    # pooled connections go back to the pool after every request, instead of persisting
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT,
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -161,3 +191,55 @@ REST_FRAMEWORK = {
 SPECTACULAR_SETTINGS = {
     "TITLE": "Django Dynamic Model Builder",
 }
+
+# Dynamic models
+
+# Maximum number of built dynamic model classes kept in memory per process
+DYNAMIC_MODEL_CACHE_SIZE = int(os.environ.get("DYNAMIC_MODEL_CACHE_SIZE", "1024"))
+
+# Maximum number of tables created by a single batch table creation request
+DYNAMIC_MODEL_BATCH_MAX_TABLES = int(os.environ.get("DYNAMIC_MODEL_BATCH_MAX_TABLES", "100"))
+
+# Number of rows inserted per statement by the bulk row insertion view
+DYNAMIC_MODEL_BULK_BATCH_SIZE = int(os.environ.get("DYNAMIC_MODEL_BULK_BATCH_SIZE", "1000"))
+
+# Load bulk inserted rows with COPY FROM STDIN instead of INSERT statements
+DYNAMIC_MODEL_BULK_USE_COPY = bool(os.environ.get("DYNAMIC_MODEL_BULK_USE_COPY", "1") == "1")
+
+# Maximum number of rejected rows listed in a bulk insertion response
+DYNAMIC_MODEL_BULK_MAX_ERRORS = int(os.environ.get("DYNAMIC_MODEL_BULK_MAX_ERRORS", "100"))
+
+# Number of rows per page returned by the get rows view, unless a limit is requested
+DYNAMIC_MODEL_ROWS_PAGE_SIZE = int(os.environ.get("DYNAMIC_MODEL_ROWS_PAGE_SIZE", "1000"))
+
+# Largest page size clients may request from the get rows view
+DYNAMIC_MODEL_ROWS_MAX_PAGE_SIZE = int(os.environ.get("DYNAMIC_MODEL_ROWS_MAX_PAGE_SIZE", "10000"))
+
+# Number of rows fetched per round-trip when streaming table rows
+DYNAMIC_MODEL_ROWS_STREAM_CHUNK_SIZE = int(os.environ.get("DYNAMIC_MODEL_ROWS_STREAM_CHUNK_SIZE", "2000"))
+
+# How the get rows view counts the rows it reports in the X-Total-Count header:
+# "exact", "estimate" (from table statistics) or "cached" (kept up to date on insertion).
+# Empty to leave the header out
+DYNAMIC_MODEL_ROW_COUNT_MODE = os.environ.get("DYNAMIC_MODEL_ROW_COUNT_MODE", "cached")
+
+# USING expressions for converting columns between field types, keyed by
+# (current type, new type), overriding the defaults in api.schema.CAST_RULES
+DYNAMIC_MODEL_CAST_RULES = {}
+
+# Online schema changes: milliseconds to wait for a table lock, attempts after a lock timeout,
+# seconds to wait before the first retry (doubled on every attempt), and rows converted per batch
+DYNAMIC_MODEL_ONLINE_LOCK_TIMEOUT = int(os.environ.get("DYNAMIC_MODEL_ONLINE_LOCK_TIMEOUT", "2000"))
+DYNAMIC_MODEL_ONLINE_LOCK_RETRIES = int(os.environ.get("DYNAMIC_MODEL_ONLINE_LOCK_RETRIES", "5"))
+DYNAMIC_MODEL_ONLINE_RETRY_BACKOFF = float(os.environ.get("DYNAMIC_MODEL_ONLINE_RETRY_BACKOFF", "0.5"))
+DYNAMIC_MODEL_ONLINE_BACKFILL_BATCH_SIZE = int(os.environ.get("DYNAMIC_MODEL_ONLINE_BACKFILL_BATCH_SIZE", "10000"))
+
+# Seconds the run_jobs command waits before checking an empty job queue again
+DYNAMIC_MODEL_JOB_POLL_INTERVAL = float(os.environ.get("DYNAMIC_MODEL_JOB_POLL_INTERVAL", "1.0"))
+
+# Seconds a running job's worker may go without a heartbeat before it's presumed dead,
+# and the job is run again by another worker. Workers send one every third of it
+DYNAMIC_MODEL_JOB_LEASE = float(os.environ.get("DYNAMIC_MODEL_JOB_LEASE", "300"))
+
+# Maximum number of rows uploaded to a queued bulk load, which are staged in the DB until it runs
+DYNAMIC_MODEL_JOB_MAX_ROWS = int(os.environ.get("DYNAMIC_MODEL_JOB_MAX_ROWS", "1000000"))